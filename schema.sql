@@ -1,11 +1,114 @@
+-- Narrow, hot table: listing and lookups never page through bulky text
 CREATE TABLE IF NOT EXISTS "block" (
   id                   string primary key,         -- Are.na block ID, or UUID, from another source 
   source_url           string,
-  crawled_text         TEXT,                       -- crawled HTML inner text or PDF body
   title                string,
   description          string,
   metadata             string,                     -- Generic metadata
   created_at           timestamp DEFAULT CURRENT_TIMESTAMP,
   updated_at           timestamp DEFAULT CURRENT_TIMESTAMP,
-  full_json            TEXT
+  arena_updated_at     string                      -- Are.na updated_at of the block when last synced
 );
+
+CREATE INDEX IF NOT EXISTS block_source_url ON block (source_url);
+CREATE INDEX IF NOT EXISTS block_updated_at ON block (updated_at);
+
+-- Bulky columns, zstd-compressed (block_storage.py); read with zstd_decompress() on a connect_db connection
+CREATE TABLE IF NOT EXISTS "block_content" (
+  block_id             string primary key,         -- block.id
+  full_json            BLOB,                       -- raw Are.na API response, compressed with the block_json dictionary
+  crawled_text         BLOB                        -- crawled HTML inner text or PDF body
+);
+
+-- Trained zstd dictionaries; compressed values record the id of the one they need
+CREATE TABLE IF NOT EXISTS "zstd_dict" (
+  id                   integer primary key,
+  name                 string,
+  data                 BLOB,
+  created_at           timestamp DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS "block_chunk" (
+  block_id             string,                     -- block.id the passage was cut from
+  chunk_index          integer,                    -- position of the passage within the block
+  char_offset          integer,                    -- offset of the passage in block.crawled_text
+  text                 TEXT,
+  heading              string,                     -- nearest markdown heading above the passage
+  created_at           timestamp DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (block_id, chunk_index)
+);
+
+CREATE TABLE IF NOT EXISTS "sync_cursor" (
+  channel_slug         string,
+  sync_name            string,                     -- "blocks" (metadata sync) or "content" (crawl)
+  last_changed_at      string,                     -- most recent Are.na updated_at/connected_at seen
+  synced_at            timestamp DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (channel_slug, sync_name)
+);
+
+CREATE TABLE IF NOT EXISTS "crawl_status" (
+  url                  string primary key,
+  state                string,                     -- "ok", "retry" (backing off) or "failed" (given up)
+  attempts             integer DEFAULT 0,          -- consecutive failed fetches
+  error_class          string,                     -- exception of the last failure, e.g. HTTPError, ConnectTimeout
+  error_message        TEXT,
+  http_status          integer,
+  last_attempt_at      timestamp DEFAULT CURRENT_TIMESTAMP,
+  next_retry_at        timestamp                   -- UTC; not fetched before this while state is "retry"
+);
+
+-- Keyword index over block text; external content, so text is read by rowid from the block_text view
+CREATE VIEW IF NOT EXISTS "block_text" AS
+  SELECT block.rowid AS rowid, block.title, block.description,
+         zstd_decompress(block_content.crawled_text) AS crawled_text
+  FROM block
+  LEFT JOIN block_content ON block_content.block_id = block.id;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS "block_fts" USING fts5(
+  title, description, crawled_text,
+  content='block_text', content_rowid='rowid',
+  tokenize='unicode61 remove_diacritics 2'
+);
+
+CREATE TRIGGER IF NOT EXISTS block_fts_insert AFTER INSERT ON block BEGIN
+  INSERT INTO block_fts (rowid, title, description, crawled_text)
+  VALUES (new.rowid, new.title, new.description,
+          (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = new.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS block_fts_delete AFTER DELETE ON block BEGIN
+  INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+  VALUES ('delete', old.rowid, old.title, old.description,
+          (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = old.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS block_fts_update AFTER UPDATE OF title, description ON block BEGIN
+  INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+  VALUES ('delete', old.rowid, old.title, old.description,
+          (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = old.id));
+  INSERT INTO block_fts (rowid, title, description, crawled_text)
+  VALUES (new.rowid, new.title, new.description,
+          (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = new.id));
+END;
+
+CREATE TRIGGER IF NOT EXISTS block_content_fts_insert AFTER INSERT ON block_content BEGIN
+  INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+  SELECT 'delete', rowid, title, description, NULL FROM block WHERE id = new.block_id;
+  INSERT INTO block_fts (rowid, title, description, crawled_text)
+  SELECT rowid, title, description, zstd_decompress(new.crawled_text) FROM block WHERE id = new.block_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS block_content_fts_update AFTER UPDATE OF crawled_text ON block_content
+WHEN old.crawled_text IS NOT new.crawled_text BEGIN
+  INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+  SELECT 'delete', rowid, title, description, zstd_decompress(old.crawled_text) FROM block WHERE id = old.block_id;
+  INSERT INTO block_fts (rowid, title, description, crawled_text)
+  SELECT rowid, title, description, zstd_decompress(new.crawled_text) FROM block WHERE id = new.block_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS block_content_fts_delete AFTER DELETE ON block_content BEGIN
+  INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+  SELECT 'delete', rowid, title, description, zstd_decompress(old.crawled_text) FROM block WHERE id = old.block_id;
+  INSERT INTO block_fts (rowid, title, description, crawled_text)
+  SELECT rowid, title, description, NULL FROM block WHERE id = old.block_id;
+END;
@@ -1,33 +1,92 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, BackgroundTasks, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, HttpUrl
 import uvicorn
-from typing import Optional
-import tempfile
+from typing import Dict, List, Literal, Optional
+import asyncio
 import os
+from contextlib import asynccontextmanager
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
 from vector_store import VectorStore
-from parse_utils import fetch_and_parse_url, fetch_and_parse_pdf
+from embedding_server import RemoteEncoder
+from parse_utils import classify_fetch_error, fetch_url_with_status, parse_pdf_bytes
 import sqlite3
 import logging
 from datetime import datetime
-from arena_utils import save_block_to_db
+from arena_utils import (
+    connect_db,
+    init_db,
+    save_block_to_db,
+    save_block_chunks_to_db,
+    get_block_ids_by_source_url,
+    get_urls_not_due,
+    keyword_search,
+    save_crawl_results,
+)
+from chunk_utils import chunk_markdown
+from query_encoder import QueryBatcher
+from hybrid_search import async_hybrid_search
+from job_queue import JobWorkerPool, init_job_queue, enqueue_job, enqueue_jobs, get_job as get_queued_job, get_jobs, get_active_url_jobs, PermanentJobError
 import json
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Block Parser API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the ingestion workers while the app is up, then stop them and the query batcher"""
+    start_ingest_workers()
+    try:
+        yield
+    finally:
+        stop_ingest_workers()
+        await query_batcher.close()
+
+app = FastAPI(title="Block Parser API", lifespan=lifespan)
 
 # Initialize vector store with environment variables
 vector_store_host = os.getenv('VECTOR_STORE_HOST')
 vector_store_port = os.getenv('VECTOR_STORE_PORT')
-vector_store = VectorStore(host=vector_store_host, port=vector_store_port)
+# With several uvicorn workers, point EMBEDDING_SERVER_SOCKET at a running
+# embedding_server.py so the workers share one copy of the model
+embedding_server_socket = os.getenv('EMBEDDING_SERVER_SOCKET')
+encoder = RemoteEncoder(embedding_server_socket) if embedding_server_socket else None
+vector_store = VectorStore(host=vector_store_host, port=vector_store_port, encoder=encoder)
+
+# Concurrent /search queries are encoded together in micro-batches
+QUERY_MAX_BATCH = int(os.getenv('QUERY_MAX_BATCH', '32'))
+QUERY_MAX_WAIT_MS = float(os.getenv('QUERY_MAX_WAIT_MS', '5'))
+query_batcher = QueryBatcher(
+    lambda texts: vector_store.generate_embeddings(texts, use_cache=False),
+    max_batch_size=QUERY_MAX_BATCH,
+    max_wait_ms=QUERY_MAX_WAIT_MS,
+)
+
+# Ingestion job queue settings
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', '2'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '16'))
+INGEST_MAX_ATTEMPTS = int(os.getenv('INGEST_MAX_ATTEMPTS', '5'))
+# Uploaded PDFs wait here until their job has run
+INGEST_SPOOL_DIR = os.getenv('INGEST_SPOOL_DIR', 'ingest_spool')
+BATCH_STATUS_POLL_INTERVAL = 1.0  # seconds between job status checks while streaming /blocks/batch progress
+
+# Network fetches of a claimed batch run here (PDFs are handed on to the PDF process pool)
+INGEST_FETCH_WORKERS = int(os.getenv('INGEST_FETCH_WORKERS', '8'))
+fetch_executor = ThreadPoolExecutor(max_workers=INGEST_FETCH_WORKERS, thread_name_prefix="ingest-fetch")
+# Embedding is serialized across ingestion workers
+index_lock = threading.Lock()
+
+def get_db_path():
+    return os.getenv('SQLITE_DB_PATH', 'store.sqlite3')
 
 # Initialize DB connection
 def get_db():
-    db_path = os.getenv('SQLITE_DB_PATH', 'store.sqlite3')
-    conn = sqlite3.connect(db_path)
+    # FastAPI opens this in a threadpool but async endpoints use it on the event loop thread
+    conn = connect_db(get_db_path(), check_same_thread=False)
     try:
         yield conn
     finally:
@@ -42,6 +101,58 @@ class URLInput(BaseModel):
 class SearchQuery(BaseModel):
     query: str
     limit: Optional[int] = 5
+    chunks: Optional[bool] = False
+    # "hybrid" fuses vector and keyword rankings, helping with rare names
+    mode: Optional[Literal["vector", "hybrid"]] = "vector"
+
+class KeywordQuery(BaseModel):
+    query: str
+    limit: Optional[int] = 5
+    raw: Optional[bool] = False  # treat query as FTS5 syntax (phrases, OR, NEAR, prefix*)
+
+def process_blocks(conn: sqlite3.Connection, blocks: List[dict]):
+    """
+    Store a batch of parsed blocks with one SQLite write and one embedding pass
+    Args:
+        conn: SQLite connection
+        blocks: Dicts with block_id, url, content and optional title, description, metadata
+    """
+    # Save to SQLite
+    block_data_by_id = {
+        block["block_id"]: {
+            "id": block["block_id"],
+            "source": {"url": block["url"]},
+            "title": block.get("title"),
+            "description": block.get("description"),
+            "metadata": block.get("metadata")
+        }
+        for block in blocks
+    }
+    save_block_to_db(
+        conn,
+        block_ids=list(block_data_by_id.keys()),
+        block_data_by_id=block_data_by_id,
+        parsed_block_content_by_url={block["url"]: block["content"] for block in blocks}
+    )
+    
+    # Save passages
+    chunks_by_block_id = {block["block_id"]: chunk_markdown(block["content"]) for block in blocks}
+    save_block_chunks_to_db(conn, chunks_by_block_id)
+    
+    # Update vector store
+    blocks_with_content = {
+        block["block_id"]: {
+            "source_url": block["url"],
+            "crawled_text": block["content"],
+            "title": block.get("title"),
+            "description": block.get("description"),
+            "metadata": block.get("metadata")
+        }
+        for block in blocks
+    }
+    with index_lock:
+        vector_store.upsert_blocks(blocks_with_content)
+        vector_store.upsert_block_chunks(blocks_with_content, chunks_by_block_id)
 
 def process_block(
     conn: sqlite3.Connection,
@@ -53,69 +164,133 @@ def process_block(
     metadata: Optional[dict] = None
 ):
     """Process and store block data"""
-    # Save to SQLite
-    block_data = {
-        "id": block_id,
-        "source": {"url": url},
+    process_blocks(conn, [{
+        "block_id": block_id,
+        "url": url,
+        "content": content,
         "title": title,
         "description": description,
         "metadata": metadata
-    }
-    
-    save_block_to_db(
-        conn,
-        block_ids=[block_id],
-        block_data_by_id={block_id: block_data},
-        parsed_block_content_by_url={url: content}
-    )
-    
-    # Update vector store
-    vector_store.upsert_blocks({
-        block_id: {
-            "source_url": url,
-            "crawled_text": content,
-            "title": title,
-            "description": description,
-            "metadata": metadata
-        }
-    })
+    }])
+
+def parse_job(job: dict):
+    """
+    Fetch and parse the content of an ingestion job
+    Returns:
+        (content or None, exception or None) tuple
+    """
+    payload = job["payload"]
+    if job["kind"] == "file":
+        try:
+            with open(payload["file_path"], "rb") as f:
+                return parse_pdf_bytes(f.read()), None
+        except Exception as e:
+            return None, e
+    return fetch_url_with_status(payload["url"])
+
+def process_job_batch(conn: sqlite3.Connection, jobs: List[dict]) -> Dict[str, Exception]:
+    """
+    Parse a claimed batch of jobs concurrently, then store the successes together
+    URL jobs consult and update crawl_status like the crawler: a new job for
+    a URL that failed permanently or is backing off fails without fetching.
+    Retries of a job are the job queue's, so they skip that check, and a
+    failure is only recorded once the job gives up on it.
+    """
+    errors = {}
+    not_due = get_urls_not_due(conn, [job["payload"]["url"] for job in jobs if job["kind"] == "url" and job["attempts"] == 1])
+    to_parse = []
+    for job in jobs:
+        status = not_due.get(job["payload"]["url"]) if job["kind"] == "url" and job["attempts"] == 1 else None
+        if status and status["state"] == "failed":
+            errors[job["job_id"]] = PermanentJobError(f"Fetching failed permanently before ({status['error_class']}, HTTP {status['http_status']})")
+        elif status:
+            errors[job["job_id"]] = PermanentJobError(f"Fetching failed before ({status['error_class']}), next retry after {status['next_retry_at']} UTC")
+        else:
+            to_parse.append(job)
+
+    blocks = []
+    crawl_results = []
+    for job, (content, error) in zip(to_parse, fetch_executor.map(parse_job, to_parse)):
+        if job["kind"] == "url":
+            if content:
+                crawl_results.append((job["payload"]["url"], None))
+            elif error is not None:
+                error_class, http_status, permanent = classify_fetch_error(error)
+                if permanent or job["attempts"] >= INGEST_MAX_ATTEMPTS:
+                    crawl_results.append((job["payload"]["url"], (error_class, str(error), http_status, permanent)))
+                if permanent:
+                    error = PermanentJobError(f"{error_class}: {error}")
+        if not content:
+            errors[job["job_id"]] = error or ValueError("Failed to parse content")
+            continue
+        blocks.append({
+            "block_id": job["block_id"],
+            "url": job["payload"]["url"],
+            "content": content,
+            "title": job["payload"].get("title"),
+            "description": job["payload"].get("description"),
+            "metadata": job["payload"].get("metadata")
+        })
+
+    save_crawl_results(conn, crawl_results)
+    if blocks:
+        process_blocks(conn, blocks)
+    return errors
+
+def remove_spooled_file(job: dict):
+    """Delete an uploaded PDF once its job no longer needs it"""
+    file_path = job["payload"].get("file_path")
+    if file_path and os.path.exists(file_path):
+        os.unlink(file_path)
+
+ingest_workers = JobWorkerPool(
+    get_db_path(),
+    process_job_batch,
+    num_workers=INGEST_WORKERS,
+    batch_size=INGEST_BATCH_SIZE,
+    max_attempts=INGEST_MAX_ATTEMPTS,
+    on_finished=remove_spooled_file,
+)
+
+def start_ingest_workers():
+    conn = connect_db(get_db_path())
+    try:
+        init_db(conn)
+        init_job_queue(conn)
+    finally:
+        conn.close()
+    os.makedirs(INGEST_SPOOL_DIR, exist_ok=True)
+    ingest_workers.start()
+
+def stop_ingest_workers():
+    ingest_workers.stop(timeout=30)
+
+def new_block_id(prefix: str) -> str:
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid4().hex[:8]}"
 
 @app.post("/blocks/url")
 async def add_block_from_url(
     url_input: URLInput,
-    background_tasks: BackgroundTasks,
     conn: sqlite3.Connection = Depends(get_db)
 ):
-    """Add a new block from URL"""
+    """Queue a new block from URL, returning a job id to poll at /jobs/{job_id}"""
     try:
         # Generate block ID
-        block_id = f"manual_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        block_id = new_block_id("manual")
         
-        # Parse content
-        if str(url_input.url).lower().endswith('.pdf'):
-            content = fetch_and_parse_pdf(str(url_input.url))
-        else:
-            content = fetch_and_parse_url(str(url_input.url))
-            
-        if not content:
-            raise HTTPException(status_code=400, detail="Failed to parse content")
-            
-        # Process in background
-        background_tasks.add_task(
-            process_block,
-            conn,
-            block_id,
-            str(url_input.url),
-            content,
-            url_input.title,
-            url_input.description,
-            url_input.metadata
-        )
+        job_id = enqueue_job(conn, "url", block_id, {
+            "url": str(url_input.url),
+            "title": url_input.title,
+            "description": url_input.description,
+            "metadata": url_input.metadata
+        })
+        ingest_workers.notify()
         
         return JSONResponse({
             "status": "success",
             "message": "Block processing started",
-            "block_id": block_id
+            "block_id": block_id,
+            "job_id": job_id
         })
         
     except Exception as e:
@@ -128,61 +303,172 @@ async def add_block_from_file(
     title: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     metadata: Optional[str] = Form(None),
-    background_tasks: BackgroundTasks = BackgroundTasks(),
     conn: sqlite3.Connection = Depends(get_db)
 ):
-    """Add a new block from uploaded file"""
+    """Queue a new block from uploaded file, returning a job id to poll at /jobs/{job_id}"""
+    # Check file type
+    if not file.filename.lower().endswith('.pdf'):
+        raise HTTPException(status_code=400, detail="Only PDF files are supported")
+
     try:
-        # Check file type
-        if not file.filename.lower().endswith('.pdf'):
-            raise HTTPException(status_code=400, detail="Only PDF files are supported")
-            
-        # Save to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-            content = await file.read()
-            tmp_file.write(content)
-            tmp_path = tmp_file.name
-            
-        try:
-            # Parse PDF
-            content = fetch_and_parse_pdf(tmp_path)
-            if not content:
-                raise HTTPException(status_code=400, detail="Failed to parse PDF")
-                
-            # Generate block ID
-            block_id = f"file_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            
-            # Process in background
-            background_tasks.add_task(
-                process_block,
-                conn,
-                block_id,
-                file.filename,  # Use filename as URL
-                content,
-                title,
-                description,
-                metadata and json.loads(metadata)
-            )
-            
-            return JSONResponse({
-                "status": "success",
-                "message": "File processing started",
-                "block_id": block_id
-            })
-            
-        finally:
-            # Clean up temporary file
-            os.unlink(tmp_path)
+        # Generate block ID
+        block_id = new_block_id("file")
+        
+        # Spool the upload to disk so the job survives a restart
+        file_path = os.path.join(INGEST_SPOOL_DIR, f"{block_id}.pdf")
+        with open(file_path, "wb") as f:
+            f.write(await file.read())
+        
+        job_id = enqueue_job(conn, "file", block_id, {
+            "url": file.filename,  # Use filename as URL
+            "file_path": file_path,
+            "title": title,
+            "description": description,
+            "metadata": metadata and json.loads(metadata)
+        })
+        ingest_workers.notify()
+        
+        return JSONResponse({
+            "status": "success",
+            "message": "File processing started",
+            "block_id": block_id,
+            "job_id": job_id
+        })
             
     except Exception as e:
         logger.error(f"Error processing file: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+async def read_batch_inputs(request: Request) -> List[URLInput]:
+    """Read URL inputs from a JSON list, {"items": [...]} or an NDJSON body"""
+    if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+        items = []
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            items.extend(json.loads(line) for line in lines if line.strip())
+        if buffer.strip():
+            items.append(json.loads(buffer))
+    else:
+        items = await request.json()
+        if isinstance(items, dict):
+            items = items.get("items", [])
+    return [URLInput(**item) for item in items]
+
+def progress_line(**fields) -> str:
+    return json.dumps(fields) + "\n"
+
+async def ingest_batch(url_inputs: List[URLInput]):
+    """
+    Deduplicate a batch of URLs and queue them as ingestion jobs, yielding
+    NDJSON progress lines as each URL is skipped, queued, indexed or failed
+    Jobs are durable: if the client disconnects they still run, and their
+    status stays available at /jobs/{job_id}. URLs another request already
+    queued are followed rather than queued again.
+    """
+    # Deduplicate within the batch
+    unique_inputs = {}
+    for url_input in url_inputs:
+        url = str(url_input.url)
+        if url in unique_inputs:
+            yield progress_line(url=url, status="skipped", reason="duplicate in batch")
+        else:
+            unique_inputs[url] = url_input
+
+    def enqueue():
+        """Deduplicate against existing blocks and active jobs, and queue the rest, in one transaction"""
+        conn = connect_db(get_db_path())
+        try:
+            # Taking the write lock up front keeps concurrent batches from both queueing a URL
+            conn.execute("BEGIN IMMEDIATE")
+            existing = get_block_ids_by_source_url(conn, unique_inputs.keys())
+            active = get_active_url_jobs(conn, [url for url in unique_inputs if url not in existing])
+            items = [
+                (new_block_id("manual"), {
+                    "url": url,
+                    "title": url_input.title,
+                    "description": url_input.description,
+                    "metadata": url_input.metadata
+                })
+                for url, url_input in unique_inputs.items()
+                if url not in existing and url not in active
+            ]
+            job_ids = enqueue_jobs(conn, "url", items)
+            conn.commit()
+            return existing, active, list(zip(job_ids, items))
+        finally:
+            conn.close()
+
+    existing, active, queued = await run_in_threadpool(enqueue)
+    ingest_workers.notify()
+    for url, block_id in existing.items():
+        yield progress_line(url=url, status="skipped", reason="already exists", block_id=block_id)
+    pending = {}
+    for url, job in active.items():
+        pending[job["job_id"]] = (url, job["block_id"])
+        yield progress_line(url=url, status="queued", reason="already queued", job_id=job["job_id"], block_id=job["block_id"])
+    for job_id, (block_id, payload) in queued:
+        pending[job_id] = (payload["url"], block_id)
+        yield progress_line(url=payload["url"], status="queued", job_id=job_id, block_id=block_id)
+
+    def finished_jobs():
+        conn = connect_db(get_db_path())
+        try:
+            jobs = get_jobs(conn, pending.keys())
+        finally:
+            conn.close()
+        return [job for job in jobs.values() if job["status"] in ("done", "failed")]
+
+    counts = {"indexed": 0, "failed": 0, "skipped": len(url_inputs) - len(pending)}
+    # Failed attempts are retried with backoff, so only report jobs that are done or given up on
+    while pending:
+        await asyncio.sleep(BATCH_STATUS_POLL_INTERVAL)
+        for job in await run_in_threadpool(finished_jobs):
+            url, block_id = pending.pop(job["job_id"])
+            if job["status"] == "done":
+                counts["indexed"] += 1
+                yield progress_line(url=url, status="indexed", block_id=block_id, job_id=job["job_id"])
+            else:
+                counts["failed"] += 1
+                yield progress_line(url=url, status="failed", error=job["error"], job_id=job["job_id"])
+
+    yield progress_line(status="complete", **counts)
+
+@app.post("/blocks/batch")
+async def add_blocks_from_urls(request: Request):
+    """
+    Add blocks from a list of URL inputs (JSON list or NDJSON body),
+    streaming per-URL progress back as NDJSON
+    """
+    try:
+        url_inputs = await read_batch_inputs(request)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch input: {e}")
+    return StreamingResponse(ingest_batch(url_inputs), media_type="application/x-ndjson")
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, conn: sqlite3.Connection = Depends(get_db)):
+    """Get the status of an ingestion job"""
+    job = get_queued_job(conn, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job.pop("payload")
+    return JSONResponse(job)
+
 @app.post("/search")
 async def search_blocks(query: SearchQuery):
-    """Search blocks by content similarity"""
+    """Search blocks by content similarity, fused with keyword ranking in hybrid mode"""
     try:
-        results = vector_store.search(query.query, limit=query.limit)
+        if query.mode == "hybrid":
+            results = await async_hybrid_search(
+                vector_store, get_db_path(), query.query,
+                limit=query.limit, chunks=query.chunks, encode=query_batcher.encode
+            )
+        else:
+            results = await vector_store.async_search(
+                query.query, limit=query.limit, chunks=query.chunks, encode=query_batcher.encode
+            )
         return JSONResponse({
             "status": "success",
             "results": results
@@ -191,5 +477,29 @@ async def search_blocks(query: SearchQuery):
         logger.error(f"Error searching blocks: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/search/keyword")
+async def search_blocks_by_keyword(query: KeywordQuery, conn: sqlite3.Connection = Depends(get_db)):
+    """Search blocks by keyword, ranked by BM25 with matches highlighted in text_preview"""
+    try:
+        results = await run_in_threadpool(keyword_search, conn, query.query, limit=query.limit, raw=query.raw)
+        return JSONResponse({
+            "status": "success",
+            "results": results
+        })
+    except sqlite3.OperationalError as e:
+        # Malformed raw FTS5 queries surface here
+        raise HTTPException(status_code=400, detail=f"Invalid keyword query: {e}")
+    except Exception as e:
+        logger.error(f"Error searching blocks by keyword: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Query encoder batching and query cache metrics"""
+    return JSONResponse({
+        "query_encoder": query_batcher.stats(),
+        "query_cache": vector_store.cache_stats(),
+    })
+
 if __name__ == "__main__":
     uvicorn.run("api_server:app", host="0.0.0.0", port=8000, reload=True)
\ No newline at end of file
@@ -1,35 +1,149 @@
-import requests
 import json
+import math
 import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from urllib.parse import urlparse
 
+import block_storage
+import http_client
+
 from arena_utils import json
 
 BLOCKS_PER_PAGE = 100  # 100 is max pages
+PAGE_FETCH_CONCURRENCY = 4  # Are.na API requests in flight while paginating
+PAGE_RETRIES = 3
+DB_READ_BATCH_SIZE = 500  # rows per paged read; also keeps IN lists under SQLite's bound variable limit
+DB_WRITE_BATCH_SIZE = 300  # rows per multi-row upsert, keeping its parameters under SQLite's bound variable limit
+CRAWL_RETRY_BASE = 3600  # seconds before retrying a failed URL, doubled per consecutive failure
+CRAWL_RETRY_MAX = 14 * 24 * 3600  # longest wait between retries
+CRAWL_MAX_ATTEMPTS = 8  # consecutive failures before a URL is given up on
+
+class ChannelPagesError(Exception):
+    """Raised after the blocks of several channels were yielded, if some of their pages could not be fetched"""
+    def __init__(self, failed_pages):
+        self.failed_pages = failed_pages  # channel slug -> page numbers
+        super().__init__(f"Failed to fetch pages {failed_pages}")
 
-def get_channel(channel_slug):
-    """Get basic channel info from Are.na API"""
-    url = f"https://api.are.na/v2/channels/{channel_slug}?per={BLOCKS_PER_PAGE}"
-    r = requests.get(url)
+def get_channel(channel_slug, per=BLOCKS_PER_PAGE):
+    """Get basic channel info, including `length` and the first page of contents, from Are.na API"""
+    url = f"https://api.are.na/v2/channels/{channel_slug}?per={per}"
+    r = http_client.get(url)
+    r.raise_for_status()
     return r.json()
 
-def get_channel_blocks_paginated(channel_slug, per=BLOCKS_PER_PAGE, pages=5):
-    """Get all blocks from a channel with pagination"""
-    blocks = []
-    has_next = True
-    page = 1
-    while has_next:
+def get_channel_page(channel_slug, page, per=BLOCKS_PER_PAGE, retries=PAGE_RETRIES):
+    """Get one page of a channel's contents, retrying failed requests with backoff"""
+    url = f"https://api.are.na/v2/channels/{channel_slug}/contents?per={per}&page={page}"
+    for attempt in range(1, retries + 1):
         try:
-            url = f"https://api.are.na/v2/channels/{channel_slug}/contents?per={BLOCKS_PER_PAGE}&page={page}"
-            r = requests.get(url)
-            data = r.json()
-            blocks.extend(data["contents"])
-            # stop requesting more when we cross the number of blocks per page
-            has_next = len(data["contents"]) == BLOCKS_PER_PAGE
-            page += 1
+            r = http_client.get(url)
+            r.raise_for_status()
+            return r.json()["contents"]
         except Exception as e:
-            print("Error", e)
-            has_next = False
+            if attempt == retries:
+                raise
+            print(f"Error fetching {channel_slug} page {page} (attempt {attempt}/{retries}):", e)
+            time.sleep(2 ** attempt)
+
+def iter_channels_blocks(channel_slugs, per=BLOCKS_PER_PAGE, pages=None, max_workers=PAGE_FETCH_CONCURRENCY):
+    """
+    Yield (channel_slug, block) for every block of several channels as pages arrive
+    Channel metadata is fetched first for each channel: it carries `length`,
+    so the page count is known up front, and the first page of contents.
+    The remaining pages of all channels are then fetched concurrently over
+    one bounded thread pool. If the last expected page comes back full the
+    channel grew mid-sync and paging continues until a short page.
+    Args:
+        channel_slugs: Are.na channel slugs
+        per: Blocks per page
+        pages: Maximum number of pages per channel (None for all)
+        max_workers: Maximum number of requests in flight
+    Raises:
+        ChannelPagesError once every other block has been yielded, if a page
+        still failed after retries, so callers can leave those channels' sync
+        cursors alone
+    """
+    page_counts = {}
+    failed_pages = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(get_channel, slug, per): (slug, 1) for slug in channel_slugs}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                slug, page = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Error fetching {slug} page {page}:", e)
+                    failed_pages.setdefault(slug, []).append(page)
+                    continue
+
+                if slug not in page_counts:
+                    # Channel metadata: schedule the remaining pages
+                    page_counts[slug] = max(1, math.ceil(result.get("length", 0) / per))
+                    if pages:
+                        page_counts[slug] = min(page_counts[slug], pages)
+                    for next_page in range(2, page_counts[slug] + 1):
+                        pending[executor.submit(get_channel_page, slug, next_page, per)] = (slug, next_page)
+                    contents = result.get("contents", [])
+                else:
+                    contents = result
+
+                if page >= page_counts[slug] and len(contents) == per and (not pages or page < pages):
+                    page_counts[slug] = page + 1
+                    pending[executor.submit(get_channel_page, slug, page + 1, per)] = (slug, page + 1)
+
+                for block in contents:
+                    yield slug, block
+    if failed_pages:
+        raise ChannelPagesError(failed_pages)
+
+def iter_channel_blocks(channel_slug, per=BLOCKS_PER_PAGE, pages=None, max_workers=PAGE_FETCH_CONCURRENCY):
+    """Yield the blocks of a channel as pages arrive, fetching pages concurrently"""
+    for _, block in iter_channels_blocks([channel_slug], per=per, pages=pages, max_workers=max_workers):
+        yield block
+
+def get_channel_blocks_paginated(channel_slug, per=BLOCKS_PER_PAGE, pages=None):
+    """Get all blocks (or the first `pages` pages) from a channel with pagination"""
+    return list(iter_channel_blocks(channel_slug, per=per, pages=pages))
+
+def block_changed_at(block):
+    """Latest of a block's Are.na updated_at and connected_at timestamps (ISO 8601 strings)"""
+    return max(filter(None, [block.get("updated_at"), block.get("connected_at")]), default=None)
+
+def get_channel_blocks_since(channel_slug, since=None, per=BLOCKS_PER_PAGE):
+    """
+    Get the blocks of a channel changed after `since`, most recent first
+    Pages are requested in descending updated_at order and pagination stops
+    at the first page whose blocks all predate `since`. If a page comes back
+    out of order the stop condition can't be trusted, so paging continues.
+    Args:
+        channel_slug: Are.na channel slug
+        since: ISO 8601 timestamp of the last sync (None fetches everything)
+        per: Blocks per page
+    Returns:
+        List of blocks changed after `since` (or all blocks)
+    Raises:
+        On any failed page: the newest pages have arrived by then, so a
+        partial list would let the sync cursor skip the missing older ones
+    """
+    blocks = []
+    page = 1
+    while True:
+        url = f"https://api.are.na/v2/channels/{channel_slug}/contents?per={per}&page={page}&sort=updated_at&direction=desc"
+        r = http_client.get(url)
+        r.raise_for_status()
+        contents = r.json()["contents"]
+
+        changed = [block for block in contents if since is None or (block_changed_at(block) or "") > since]
+        blocks.extend(changed)
+
+        updated = [block.get("updated_at") or "" for block in contents]
+        ordered = updated == sorted(updated, reverse=True)
+        if len(contents) < per or (since is not None and ordered and not changed):
+            break
+        page += 1
     return blocks
 
 def get_hostname(url):
@@ -45,13 +159,31 @@ def filter_blocks_by_hostname(blocks, hostname_whitelist={"https://en.wikipedia.
         and get_hostname(block["source"].get("url", "")) in hostname_whitelist
     ]
 
+def connect_db(path, timeout=30, **kwargs):
+    """
+    Open the block store: WAL journaling so readers don't block the crawler's
+    writes, and the zstd_decompress() SQL function and dictionaries that
+    compressed block_content and the keyword index need
+    """
+    conn = sqlite3.connect(path, timeout=timeout, **kwargs)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")  # safe with WAL; fsyncs on checkpoint instead of every commit
+    block_storage.register_functions(conn)
+    block_storage.load_dictionaries(conn)
+    return conn
+
 def save_block_to_db(conn, block_ids, block_data_by_id, parsed_block_content_by_url):
     """
     Upsert block data to SQLITE DB, especially crawled text body
+    Metadata goes to the narrow block table, and the API response and
+    crawled text to block_content, zstd-compressed. Rows whose data is
+    unchanged are not rewritten, and blocks without parsed content keep
+    their previously crawled text.
     """
     cur = conn.cursor()
 
     data = []
+    contents = []
     for block_id in block_ids:
         block_valid = block_data_by_id.get(block_id) is not None
         block_url_valid = block_data_by_id.get(block_id).get("source") is not None
@@ -60,11 +192,17 @@ def save_block_to_db(conn, block_ids, block_data_by_id, parsed_block_content_by_
                 data.append((
                     block_id, # Are.na block ID
                     block_data_by_id[block_id].get("source", {}).get("url"), # path to website
-                    json.dumps(block_data_by_id[block_id]), # raw body from API excluding crawled text
-                    parsed_block_content_by_url.get(block_data_by_id[block_id].get("source", {}).get("url")), # markdown content
                     block_data_by_id[block_id].get("title"),
                     block_data_by_id[block_id].get("description"),
                     json.dumps(block_data_by_id[block_id].get("metadata")) if block_data_by_id[block_id].get("metadata") else None,
+                    block_data_by_id[block_id].get("updated_at"), # Are.na last modified time
+                ))
+                contents.append((
+                    block_id,
+                    # raw body from API excluding crawled text
+                    block_storage.compress(json.dumps(block_data_by_id[block_id]), block_storage.DICT_NAME),
+                    # markdown content
+                    block_storage.compress(parsed_block_content_by_url.get(block_data_by_id[block_id].get("source", {}).get("url"))),
                 ))
             except Exception as e:
                 print(f"Failed to format block {block_id} for SQL:", e)
@@ -73,76 +211,593 @@ def save_block_to_db(conn, block_ids, block_data_by_id, parsed_block_content_by_
     INSERT INTO "block" (
       id,
       source_url,
-      full_json,
-      crawled_text,
       title,
       description,
-      metadata
+      metadata,
+      arena_updated_at
      ) VALUES (
-      ?, ?, ?, ?, ?, ?, ?
+      ?, ?, ?, ?, ?, ?
      )
       ON CONFLICT (id)
       DO UPDATE SET
         source_url = excluded.source_url,
-        full_json = excluded.full_json,
-        crawled_text = excluded.crawled_text,
         title = excluded.title,
         description = excluded.description,
         metadata = excluded.metadata,
-        updated_at = CURRENT_TIMESTAMP;
+        arena_updated_at = excluded.arena_updated_at,
+        updated_at = CURRENT_TIMESTAMP
+      -- leave unchanged rows (and their updated_at) alone
+      WHERE block.source_url IS NOT excluded.source_url
+        OR block.title IS NOT excluded.title
+        OR block.description IS NOT excluded.description
+        OR block.metadata IS NOT excluded.metadata
+        OR block.arena_updated_at IS NOT excluded.arena_updated_at;
     """
     cur.executemany(query, data)
+
+    # Compare decompressed values: the same JSON compresses differently once
+    # a new dictionary is trained. RETURNING yields only inserted or updated rows.
+    content_changed = []
+    for start in range(0, len(contents), DB_WRITE_BATCH_SIZE):
+        batch = contents[start:start + DB_WRITE_BATCH_SIZE]
+        cur.execute(f"""
+        INSERT INTO "block_content" (block_id, full_json, crawled_text) VALUES {','.join(['(?, ?, ?)'] * len(batch))}
+          ON CONFLICT (block_id)
+          DO UPDATE SET
+            full_json = excluded.full_json,
+            crawled_text = COALESCE(excluded.crawled_text, block_content.crawled_text)
+          WHERE zstd_decompress(block_content.full_json) IS NOT zstd_decompress(excluded.full_json)
+            OR (excluded.crawled_text IS NOT NULL
+                AND zstd_decompress(block_content.crawled_text) IS NOT zstd_decompress(excluded.crawled_text))
+          RETURNING block_id;
+        """, [value for row in batch for value in row])
+        content_changed.extend(cur.fetchall())
+    cur.executemany('UPDATE "block" SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', content_changed)
     conn.commit()
 
 def init_db(conn):
     """Initialize SQLite database with block table"""
+    # The keyword index reads compressed text, so also usable with a plain sqlite3 connection
+    block_storage.register_functions(conn)
+    block_storage.load_dictionaries(conn)
     cur = conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
     cur.execute("""
     CREATE TABLE IF NOT EXISTS "block" (
       id                   string primary key,
       source_url          string,
-      crawled_text        TEXT,
       title               string,
       description         string, 
       metadata            string,
       created_at          timestamp DEFAULT CURRENT_TIMESTAMP,
       updated_at          timestamp DEFAULT CURRENT_TIMESTAMP,
-      full_json           TEXT
+      arena_updated_at    string
+    );
+    """)
+    # Migrate databases created before arena_updated_at was tracked
+    columns = {row[1] for row in cur.execute('PRAGMA table_info("block")')}
+    if "arena_updated_at" not in columns:
+        cur.execute('ALTER TABLE "block" ADD COLUMN arena_updated_at string')
+        cur.execute("""UPDATE "block" SET arena_updated_at = json_extract(full_json, '$.updated_at') WHERE json_valid(full_json)""")
+    if "full_json" in columns:
+        migrate_block_content(conn)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS "block_content" (
+      block_id            string primary key,
+      full_json           BLOB,
+      crawled_text        BLOB
+    );
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS block_source_url ON block (source_url)')
+    cur.execute('CREATE INDEX IF NOT EXISTS block_updated_at ON block (updated_at)')
+    block_storage.init_dict_table(conn)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS "block_chunk" (
+      block_id            string,
+      chunk_index         integer,
+      char_offset         integer,
+      text                TEXT,
+      heading             string,
+      created_at          timestamp DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (block_id, chunk_index)
+    );
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS "sync_cursor" (
+      channel_slug        string,
+      sync_name           string,
+      last_changed_at     string,
+      synced_at           timestamp DEFAULT CURRENT_TIMESTAMP,
+      PRIMARY KEY (channel_slug, sync_name)
     );
     """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS "crawl_status" (
+      url                 string primary key,
+      state               string,
+      attempts            integer DEFAULT 0,
+      error_class         string,
+      error_message       TEXT,
+      http_status         integer,
+      last_attempt_at     timestamp DEFAULT CURRENT_TIMESTAMP,
+      next_retry_at       timestamp
+    );
+    """)
+    init_block_fts(cur)
     conn.commit()
 
 
-def get_blocks_with_content_from_db(conn, block_ids):
-    """Get full block data including crawled text from DB"""
+def migrate_block_content(conn):
+    """
+    Convert a database from the original layout, with full_json and
+    crawled_text stored as TEXT in block, to compressed block_content rows
+    Runs in one transaction, then trains the full_json dictionary and
+    VACUUMs to return the freed pages to the filesystem.
+    """
+    count = conn.execute('SELECT COUNT(*) FROM block').fetchone()[0]
+    print(f"Migrating {count} blocks to compressed block_content storage")
+    conn.commit()
     cur = conn.cursor()
-    placeholders = ','.join('?' * len(block_ids))
-    cur.execute(f"""
-        SELECT id, source_url, crawled_text, title, description, metadata 
-        FROM block 
-        WHERE id IN ({placeholders})
-    """, block_ids)
+    cur.execute("BEGIN")
+    try:
+        # The keyword index is rebuilt over the new layout by init_block_fts
+        for trigger in ("block_fts_insert", "block_fts_delete", "block_fts_update"):
+            cur.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        cur.execute('DROP TABLE IF EXISTS block_fts')
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS "block_content" (
+          block_id            string primary key,
+          full_json           BLOB,
+          crawled_text        BLOB
+        );
+        """)
+        last_rowid = 0
+        while True:
+            rows = cur.execute("""
+                SELECT rowid, id, full_json, crawled_text FROM block
+                WHERE rowid > ?
+                ORDER BY rowid
+                LIMIT ?
+            """, (last_rowid, DB_READ_BATCH_SIZE)).fetchall()
+            if not rows:
+                break
+            last_rowid = rows[-1][0]
+            cur.executemany(
+                'INSERT OR REPLACE INTO block_content (block_id, full_json, crawled_text) VALUES (?, ?, ?)',
+                [(block_id, block_storage.compress(full_json), block_storage.compress(crawled_text)) for _, block_id, full_json, crawled_text in rows],
+            )
+        cur.execute('ALTER TABLE block DROP COLUMN full_json')
+        cur.execute('ALTER TABLE block DROP COLUMN crawled_text')
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    block_storage.init_dict_table(conn)
+    block_storage.train_dictionary(conn)
+    conn.execute("VACUUM")
+    print("Migrated blocks to compressed storage")
 
-    return {
-        row[0]: {
-            "source_url": row[1],
-            "crawled_text": row[2],
-            "title": row[3],
-            "description": row[4],
-            "metadata": json.loads(row[5]) if row[5] else None
+
+def init_block_fts(cur):
+    """
+    Create the block_fts keyword index over block title, description and
+    crawled_text, kept in sync by triggers on block and block_content. It is
+    an external content table reading text by rowid from the block_text
+    view, which decompresses crawled_text, so text is not stored twice and
+    connections need zstd_decompress() (see connect_db). After a VACUUM
+    (which may renumber rowids) run
+    INSERT INTO block_fts(block_fts) VALUES('rebuild').
+    """
+    exists = cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'block_fts'").fetchone()
+    cur.execute("""
+    CREATE VIEW IF NOT EXISTS "block_text" AS
+      SELECT block.rowid AS rowid, block.title, block.description,
+             zstd_decompress(block_content.crawled_text) AS crawled_text
+      FROM block
+      LEFT JOIN block_content ON block_content.block_id = block.id;
+    """)
+    # remove_diacritics lets "oyo" match "Ọ̀yọ́" and other tone-marked Yoruba
+    cur.execute("""
+    CREATE VIRTUAL TABLE IF NOT EXISTS "block_fts" USING fts5(
+      title, description, crawled_text,
+      content='block_text', content_rowid='rowid',
+      tokenize='unicode61 remove_diacritics 2'
+    );
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_fts_insert AFTER INSERT ON block BEGIN
+      INSERT INTO block_fts (rowid, title, description, crawled_text)
+      VALUES (new.rowid, new.title, new.description,
+              (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = new.id));
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_fts_delete AFTER DELETE ON block BEGIN
+      INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+      VALUES ('delete', old.rowid, old.title, old.description,
+              (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = old.id));
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_fts_update AFTER UPDATE OF title, description ON block BEGIN
+      INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+      VALUES ('delete', old.rowid, old.title, old.description,
+              (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = old.id));
+      INSERT INTO block_fts (rowid, title, description, crawled_text)
+      VALUES (new.rowid, new.title, new.description,
+              (SELECT zstd_decompress(crawled_text) FROM block_content WHERE block_id = new.id));
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_content_fts_insert AFTER INSERT ON block_content BEGIN
+      INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+      SELECT 'delete', rowid, title, description, NULL FROM block WHERE id = new.block_id;
+      INSERT INTO block_fts (rowid, title, description, crawled_text)
+      SELECT rowid, title, description, zstd_decompress(new.crawled_text) FROM block WHERE id = new.block_id;
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_content_fts_update AFTER UPDATE OF crawled_text ON block_content
+    WHEN old.crawled_text IS NOT new.crawled_text BEGIN
+      INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+      SELECT 'delete', rowid, title, description, zstd_decompress(old.crawled_text) FROM block WHERE id = old.block_id;
+      INSERT INTO block_fts (rowid, title, description, crawled_text)
+      SELECT rowid, title, description, zstd_decompress(new.crawled_text) FROM block WHERE id = new.block_id;
+    END;
+    """)
+    cur.execute("""
+    CREATE TRIGGER IF NOT EXISTS block_content_fts_delete AFTER DELETE ON block_content BEGIN
+      INSERT INTO block_fts (block_fts, rowid, title, description, crawled_text)
+      SELECT 'delete', rowid, title, description, zstd_decompress(old.crawled_text) FROM block WHERE id = old.block_id;
+      INSERT INTO block_fts (rowid, title, description, crawled_text)
+      SELECT rowid, title, description, NULL FROM block WHERE id = old.block_id;
+    END;
+    """)
+    if not exists:
+        # Index blocks saved before the keyword index existed
+        cur.execute("INSERT INTO block_fts (block_fts) VALUES ('rebuild')")
+
+
+def fts_query(text, match_all=True):
+    """
+    Turn free text into an FTS5 query matching all (or, if not match_all, any)
+    of its terms, so user input can't be a syntax error
+    """
+    terms = ['"' + term.replace('"', '""') + '"' for term in text.split()]
+    return (" " if match_all else " OR ").join(terms)
+
+
+def keyword_search(conn, query, limit=5, raw=False, match_all=True, highlight=("**", "**"), snippet_tokens=24):
+    """
+    BM25-ranked keyword search over block title, description and crawled_text
+    Args:
+        query: Terms that must all appear (or an FTS5 query if raw is set,
+            e.g. '"oba of benin" OR ooni')
+        limit: Maximum number of results to return
+        raw: Pass query to FTS5 unchanged
+        match_all: Require every term; otherwise any term matches and BM25
+            ranks blocks matching more (and rarer) terms first
+        highlight: Markers put around matched terms in text_preview
+        snippet_tokens: Length of text_preview in tokens (at most 64)
+    Returns:
+        List of blocks with their scores (higher is better), with the best
+        matching fragment of the text as text_preview
+    """
+    match = query if raw else fts_query(query, match_all=match_all)
+    if not match:
+        return []
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT block.id, block.title, block.description, block.source_url,
+               bm25(block_fts, 10.0, 5.0, 1.0) AS rank,
+               snippet(block_fts, -1, ?, ?, '…', ?)
+        FROM block_fts
+        JOIN block ON block.rowid = block_fts.rowid
+        WHERE block_fts MATCH ?
+        ORDER BY rank
+        LIMIT ?
+    """, (highlight[0], highlight[1], snippet_tokens, match, limit))
+    return [
+        {
+            # bm25() is lower for better matches
+            "score": -row[4],
+            "block_id": row[0],
+            "title": row[1],
+            "description": row[2],
+            "source_url": row[3],
+            "text_preview": row[5],
         }
         for row in cur.fetchall()
+    ]
+
+
+def _block_with_content(row):
+    return {
+        "source_url": row[1],
+        "crawled_text": block_storage.decompress(row[2]),
+        "title": row[3],
+        "description": row[4],
+        "metadata": json.loads(row[5]) if row[5] else None
+    }
+
+
+def get_blocks_with_content_from_db(conn, block_ids, batch_size=DB_READ_BATCH_SIZE):
+    """Get full block data including crawled text from DB"""
+    blocks = {}
+    for batch in iter_blocks_with_content_from_db(conn, block_ids, batch_size):
+        blocks.update(batch)
+    return blocks
+
+
+def iter_blocks_with_content_from_db(conn, block_ids, batch_size=DB_READ_BATCH_SIZE):
+    """Yield dicts of block_id -> full block data for successive batches of block_ids"""
+    cur = conn.cursor()
+    block_ids = list(block_ids)
+    for start in range(0, len(block_ids), batch_size):
+        batch = block_ids[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        cur.execute(f"""
+            SELECT block.id, source_url, crawled_text, title, description, metadata
+            FROM block
+            LEFT JOIN block_content ON block_content.block_id = block.id
+            WHERE block.id IN ({placeholders})
+        """, batch)
+        yield {row[0]: _block_with_content(row) for row in cur.fetchall()}
+
+
+def iter_blocks_from_db(conn, batch_size=DB_READ_BATCH_SIZE, since=None, content_only=False):
+    """
+    Page through the block table in rowid order, so memory stays bounded by one batch
+    Args:
+        batch_size: Blocks per yielded batch
+        since: Only blocks whose row was updated after this timestamp
+            ('YYYY-MM-DD HH:MM:SS', UTC, as stored in updated_at)
+        content_only: Skip blocks without crawled text
+    Yields:
+        Dicts of block_id -> full block data
+    """
+    cur = conn.cursor()
+    conditions = ["block.rowid > ?"]
+    params = []
+    if since:
+        conditions.append("block.updated_at > ?")
+        params.append(since)
+    if content_only:
+        conditions.append("block_content.crawled_text IS NOT NULL")
+    last_rowid = 0
+    while True:
+        # Keyset pagination: each page starts after the last rowid seen, unlike OFFSET which rescans
+        cur.execute(f"""
+            SELECT block.id, source_url, crawled_text, title, description, metadata, block.rowid
+            FROM block
+            LEFT JOIN block_content ON block_content.block_id = block.id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY block.rowid
+            LIMIT ?
+        """, [last_rowid, *params, batch_size])
+        rows = cur.fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][6]
+        yield {row[0]: _block_with_content(row) for row in rows}
+
+
+def get_existing_blocks_from_db(conn, block_ids, batch_size=DB_READ_BATCH_SIZE):
+    """Fetch the source URL of existing blocks and whether they have crawled text"""
+    cur = conn.cursor()
+    block_ids = list(block_ids)
+    existing = {}
+    for start in range(0, len(block_ids), batch_size):
+        batch = block_ids[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        cur.execute(f"""
+            SELECT block.id, source_url, block_content.crawled_text IS NOT NULL
+            FROM block
+            LEFT JOIN block_content ON block_content.block_id = block.id
+            WHERE block.id IN ({placeholders})
+        """, batch)
+        existing.update(
+            (row[0], {"source_url": row[1], "has_content": bool(row[2])})
+            for row in cur.fetchall()
+        )
+    return existing
+
+def save_block_chunks_to_db(conn, chunks_by_block_id):
+    """
+    Replace the stored chunks of each block with freshly computed ones
+    Args:
+        conn: SQLite connection
+        chunks_by_block_id: Dict of block_id -> list of chunks from chunk_utils.chunk_markdown
+    """
+    cur = conn.cursor()
+    block_ids = list(chunks_by_block_id.keys())
+    cur.executemany('DELETE FROM "block_chunk" WHERE block_id = ?', [(block_id,) for block_id in block_ids])
+    cur.executemany("""
+    INSERT INTO "block_chunk" (block_id, chunk_index, char_offset, text, heading)
+    VALUES (?, ?, ?, ?, ?)
+    """, [
+        (block_id, chunk["chunk_index"], chunk["offset"], chunk["text"], chunk.get("heading"))
+        for block_id, chunks in chunks_by_block_id.items()
+        for chunk in chunks
+    ])
+    conn.commit()
+
+
+def get_sync_cursor(conn, channel_slug, sync_name="blocks"):
+    """
+    Get the Are.na timestamp of the most recent block seen by the last sync of a channel
+    Each kind of sync (e.g. "blocks" for metadata, "content" for crawling) keeps its own cursor.
+    """
+    cur = conn.cursor()
+    cur.execute('SELECT last_changed_at FROM sync_cursor WHERE channel_slug = ? AND sync_name = ?', (channel_slug, sync_name))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def save_sync_cursor(conn, channel_slug, blocks, sync_name="blocks"):
+    """Advance a channel's sync cursor to the most recent change among the synced blocks"""
+    changed_at = max(filter(None, map(block_changed_at, blocks)), default=None)
+    cur = conn.cursor()
+    cur.execute("""
+    INSERT INTO sync_cursor (channel_slug, sync_name, last_changed_at) VALUES (?, ?, ?)
+      ON CONFLICT (channel_slug, sync_name)
+      DO UPDATE SET
+        last_changed_at = MAX(COALESCE(excluded.last_changed_at, ''), COALESCE(sync_cursor.last_changed_at, '')),
+        synced_at = CURRENT_TIMESTAMP;
+    """, (channel_slug, sync_name, changed_at))
+    conn.commit()
+
+
+def get_changed_block_ids(conn, block_data_by_id, batch_size=DB_READ_BATCH_SIZE):
+    """Get ids of blocks that are new or whose Are.na updated_at differs from the stored row"""
+    block_ids = list(block_data_by_id.keys())
+    cur = conn.cursor()
+    stored = {}
+    for start in range(0, len(block_ids), batch_size):
+        batch = block_ids[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        cur.execute(f"""
+            SELECT id, arena_updated_at
+            FROM block
+            WHERE id IN ({placeholders})
+        """, batch)
+        stored.update(cur.fetchall())
+    return [
+        block_id for block_id, block in block_data_by_id.items()
+        if block_id not in stored or stored[block_id] != block.get("updated_at")
+    ]
+
+
+def get_block_ids_by_source_url(conn, urls, batch_size=DB_READ_BATCH_SIZE):
+    """Get source_url -> block id for URLs that already have a block"""
+    cur = conn.cursor()
+    urls = list(urls)
+    block_ids_by_url = {}
+    for start in range(0, len(urls), batch_size):
+        batch = urls[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        cur.execute(f"""
+            SELECT source_url, id
+            FROM block
+            WHERE source_url IN ({placeholders})
+        """, batch)
+        block_ids_by_url.update(cur.fetchall())
+    return block_ids_by_url
+
+
+def get_crawl_status(conn, urls, batch_size=DB_READ_BATCH_SIZE):
+    """Get url -> crawl_status row for URLs fetched before"""
+    cur = conn.cursor()
+    urls = list(urls)
+    status_by_url = {}
+    for start in range(0, len(urls), batch_size):
+        batch = urls[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        cur.execute(f"""
+            SELECT url, state, attempts, error_class, http_status, next_retry_at
+            FROM crawl_status
+            WHERE url IN ({placeholders})
+        """, batch)
+        for url, state, attempts, error_class, http_status, next_retry_at in cur.fetchall():
+            status_by_url[url] = {
+                "state": state,
+                "attempts": attempts,
+                "error_class": error_class,
+                "http_status": http_status,
+                "next_retry_at": next_retry_at,
+            }
+    return status_by_url
+
+
+def get_urls_not_due(conn, urls, batch_size=DB_READ_BATCH_SIZE):
+    """
+    Get url -> crawl_status row for URLs that should not be fetched now:
+    permanently failed ones, and failed ones still waiting out their backoff
+    """
+    now = conn.execute("SELECT datetime('now')").fetchone()[0]
+    return {
+        url: status for url, status in get_crawl_status(conn, urls, batch_size).items()
+        if status["state"] == "failed"
+        or (status["state"] == "retry" and status["next_retry_at"] > now)
     }
 
 
-def get_existing_blocks_from_db(conn, block_ids):
-    """Fetch existing blocks from DB"""
+def get_blocks_to_recrawl(conn, batch_size=DB_READ_BATCH_SIZE):
+    """
+    Get the Are.na data of saved blocks that have a source URL but no crawled
+    text and are due a fetch per crawl_status
+    Incremental crawls only see blocks changed on Are.na, so blocks whose
+    crawl failed are picked up again here.
+    """
     cur = conn.cursor()
-    placeholders = ','.join('?' * len(block_ids))
-    cur.execute(f"""
-        SELECT id, source_url, crawled_text 
-        FROM block 
-        WHERE id IN ({placeholders})
-    """, block_ids)
-    return {row[0]: {"source_url": row[1], "crawled_text": row[2]}
-            for row in cur.fetchall()}
\ No newline at end of file
+    blocks = []
+    last_rowid = 0
+    while True:
+        cur.execute("""
+            SELECT block.rowid, block_content.full_json
+            FROM block
+            LEFT JOIN block_content ON block_content.block_id = block.id
+            LEFT JOIN crawl_status ON crawl_status.url = block.source_url
+            WHERE block.rowid > ?
+              AND block.source_url IS NOT NULL
+              AND block_content.full_json IS NOT NULL
+              AND block_content.crawled_text IS NULL
+              AND (crawl_status.state IS NULL
+                   OR crawl_status.state = 'ok'
+                   OR (crawl_status.state = 'retry' AND crawl_status.next_retry_at <= datetime('now')))
+            ORDER BY block.rowid
+            LIMIT ?
+        """, (last_rowid, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return blocks
+        last_rowid = rows[-1][0]
+        blocks.extend(json.loads(block_storage.decompress(row[1])) for row in rows)
+
+
+def crawl_retry_delay(attempts):
+    """Seconds to wait before the next fetch of a URL that failed `attempts` times in a row"""
+    return min(CRAWL_RETRY_BASE * 2 ** (attempts - 1), CRAWL_RETRY_MAX)
+
+
+def save_crawl_results(conn, results):
+    """
+    Record fetch outcomes in crawl_status
+    Successes reset a URL to "ok". Failures increment its attempts and
+    schedule a retry with exponential backoff ("retry"), or give up on it
+    ("failed") when the error is permanent or it failed CRAWL_MAX_ATTEMPTS
+    times in a row.
+    Args:
+        results: List of (url, error) tuples; error is None on success, else
+            an (error class, message, HTTP status, permanent) tuple
+    """
+    if not results:
+        return
+    previous = get_crawl_status(conn, [url for url, _ in results])
+    data = []
+    for url, error in results:
+        if error is None:
+            data.append((url, "ok", 0, None, None, None, None))
+            continue
+        error_class, message, http_status, permanent = error
+        attempts = previous.get(url, {}).get("attempts", 0) + 1
+        if permanent or attempts >= CRAWL_MAX_ATTEMPTS:
+            data.append((url, "failed", attempts, error_class, message, http_status, None))
+        else:
+            data.append((url, "retry", attempts, error_class, message, http_status, f"+{crawl_retry_delay(attempts)} seconds"))
+
+    cur = conn.cursor()
+    cur.executemany("""
+    INSERT INTO crawl_status (url, state, attempts, error_class, error_message, http_status, next_retry_at)
+    VALUES (?, ?, ?, ?, ?, ?, datetime('now', ?))
+      ON CONFLICT (url)
+      DO UPDATE SET
+        state = excluded.state,
+        attempts = excluded.attempts,
+        error_class = excluded.error_class,
+        error_message = excluded.error_message,
+        http_status = excluded.http_status,
+        last_attempt_at = CURRENT_TIMESTAMP,
+        next_retry_at = excluded.next_retry_at;
+    """, data)
+    conn.commit()
@@ -0,0 +1,130 @@
+import argparse
+import logging
+import tempfile
+import time
+
+import numpy as np
+
+from numpy_index import NumpyIndex, RESCORE_OVERSAMPLING
+
+logger = logging.getLogger(__name__)
+
+MODES = (None, "int8", "binary")
+# Bytes per dimension Qdrant keeps in RAM for each mode (originals go on disk when quantized)
+QDRANT_BYTES_PER_DIM = {None: 4, "int8": 1, "binary": 1 / 8}
+
+def load_vectors_from_db(db_path, max_blocks, num_queries, model_name):
+    """Embed crawled blocks and use random block titles as queries"""
+    from arena_utils import connect_db, iter_blocks_from_db
+    from vector_store import VectorStore
+
+    conn = connect_db(db_path)
+    rows = []
+    for blocks in iter_blocks_from_db(conn, content_only=True):
+        rows.extend((block["title"], block["crawled_text"]) for block in blocks.values() if block["crawled_text"])
+        if len(rows) >= max_blocks:
+            break
+    conn.close()
+    rows = rows[:max_blocks]
+    if not rows:
+        raise SystemExit(f"No crawled blocks in {db_path}; use --synthetic")
+
+    with tempfile.TemporaryDirectory() as index_path:
+        # Only used for its (cached) encoder
+        vector_store = VectorStore(model_name=model_name, backend="numpy", index_path=index_path)
+        vectors = np.asarray(vector_store.generate_embeddings([text for _, text in rows]), dtype=np.float32)
+        titles = [title for title, _ in rows if title]
+        rng = np.random.default_rng(0)
+        picked = [titles[i] for i in rng.choice(len(titles), size=min(num_queries, len(titles)), replace=False)]
+        queries = np.asarray(vector_store.generate_embeddings(picked, use_cache=False), dtype=np.float32)
+    return vectors, queries
+
+def synthetic_vectors(count, num_queries, dim=384, clusters=200):
+    """Clustered random unit vectors, roughly shaped like sentence embeddings of a topical archive"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(clusters, dim))
+    def sample(n):
+        points = centers[rng.integers(clusters, size=n)] + rng.normal(scale=0.6, size=(n, dim))
+        return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+    return sample(count), sample(num_queries)
+
+def recall(results, truth):
+    return float(np.mean([len(set(r) & set(t)) / len(t) for r, t in zip(results, truth)]))
+
+def run_numpy(vectors, queries, k, oversampling):
+    rows = []
+    truth = None
+    for mode in MODES:
+        with tempfile.TemporaryDirectory() as path:
+            index = NumpyIndex(path, vectors.shape[1], quantization=mode, rescore_oversampling=oversampling)
+            for start in range(0, len(vectors), 1024):
+                index.add([(start + i, vector, {}) for i, vector in enumerate(vectors[start:start + 1024])])
+            results, latencies = [], []
+            for query in queries:
+                started = time.perf_counter()
+                hits = index.search(query, k)
+                latencies.append(time.perf_counter() - started)
+                results.append([hit.id for hit in hits])
+            if truth is None:
+                truth = results
+            rows.append(("numpy", mode, recall(results, truth), latencies, index.search_memory_bytes()))
+    return rows, truth
+
+def run_qdrant(vectors, queries, truth, k, oversampling, host, port):
+    from qdrant_backend import QdrantBackend
+
+    rows = []
+    for mode in MODES:
+        backend = QdrantBackend(host=host, port=port, quantization=mode, rescore_oversampling=oversampling)
+        name = f"quantization_benchmark_{mode or 'float32'}"
+        backend.client.delete_collection(name)
+        backend.create_collection(name, vectors.shape[1])
+        try:
+            for start in range(0, len(vectors), 256):
+                backend.upsert(name, [(start + i, vector.tolist(), {}) for i, vector in enumerate(vectors[start:start + 256])])
+            while backend.client.get_collection(name).status != "green":
+                time.sleep(0.5)
+            results, latencies = [], []
+            for query in queries:
+                started = time.perf_counter()
+                hits = backend.search(name, query.tolist(), k)
+                latencies.append(time.perf_counter() - started)
+                results.append([hit.id for hit in hits])
+            memory = int(len(vectors) * vectors.shape[1] * QDRANT_BYTES_PER_DIM[mode])
+            rows.append(("qdrant", mode, recall(results, truth), latencies, memory))
+        finally:
+            backend.client.delete_collection(name)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare recall, latency and memory of float32, int8 and binary vector storage')
+    parser.add_argument('--db', default='../../store.sqlite3', help='SQLite database whose crawled blocks are embedded (default: ../../store.sqlite3)')
+    parser.add_argument('--max-blocks', type=int, default=20000, help='Blocks embedded from the database (default: 20000)')
+    parser.add_argument('--synthetic', type=int, help='Use this many synthetic clustered vectors instead of the database')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries (default: 200)')
+    parser.add_argument('--k', type=int, default=10, help='Results per query; recall is measured at k (default: 10)')
+    parser.add_argument('--oversampling', type=float, default=RESCORE_OVERSAMPLING,
+                        help=f'Quantized candidates rescored per result (default: {RESCORE_OVERSAMPLING})')
+    parser.add_argument('--model', default='all-MiniLM-L6-v2', help='Embedding model used with --db')
+    parser.add_argument('--qdrant-host', help='Also benchmark quantized collections on this Qdrant server')
+    parser.add_argument('--qdrant-port', type=int, help='Qdrant server port')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.synthetic:
+        vectors, queries = synthetic_vectors(args.synthetic, args.queries)
+    else:
+        vectors, queries = load_vectors_from_db(args.db, args.max_blocks, args.queries, args.model)
+    print(f"{len(vectors)} vectors of {vectors.shape[1]} dims, {len(queries)} queries, recall@{args.k}, oversampling {args.oversampling}\n")
+
+    rows, truth = run_numpy(vectors, queries, args.k, args.oversampling)
+    if args.qdrant_host:
+        rows += run_qdrant(vectors, queries, truth, args.k, args.oversampling, args.qdrant_host, args.qdrant_port)
+
+    print(f"{'backend':<8} {'mode':<8} {'recall':>7} {'p50 ms':>8} {'p95 ms':>8} {'vector RAM':>12}")
+    for backend, mode, recall_at_k, latencies, memory in rows:
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{backend:<8} {mode or 'float32':<8} {recall_at_k:>7.3f} {p50:>8.2f} {p95:>8.2f} {memory / 1024 ** 2:>10.1f}MB")
+
+if __name__ == "__main__":
+    main()
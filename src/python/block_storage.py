@@ -0,0 +1,165 @@
+import argparse
+import logging
+import sqlite3
+import threading
+
+import zstandard
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 9                  # compression level for stored JSON and crawled text
+DICT_NAME = "block_json"        # dictionary used for block full_json
+DICT_SIZE = 64 * 1024           # bytes of a trained dictionary
+DICT_SAMPLES = 5000             # full_json documents sampled to train a dictionary
+DICT_MIN_SAMPLES = 200          # fewer blocks than this are not worth a dictionary
+RECOMPRESS_BATCH_SIZE = 500
+
+# zstd dictionary id -> dictionary, and dictionary name -> id of the newest one.
+# Frames record the id of their dictionary, so old rows stay readable after retraining.
+_dicts = {}
+_current_dict_ids = {}
+_dicts_lock = threading.Lock()
+# Database files dictionaries were loaded from, re-read when a frame uses an unknown
+# dictionary, e.g. one trained by `block_storage.py --train-dict` since this process started
+_dict_db_paths = set()
+# Compressor objects are not thread-safe, so each thread keeps its own
+_local = threading.local()
+
+def init_dict_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS "zstd_dict" (
+      id                  integer primary key,
+      name                string,
+      data                BLOB,
+      created_at          timestamp DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+
+def load_dictionaries(conn):
+    """Load the zstd dictionaries stored in a database, if it has any"""
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    if path:
+        _dict_db_paths.add(path)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'zstd_dict'").fetchone()
+    if not exists:
+        return
+    with _dicts_lock:
+        for dict_id, name, data in conn.execute('SELECT id, name, data FROM zstd_dict ORDER BY created_at, rowid'):
+            _dicts.setdefault(dict_id, zstandard.ZstdCompressionDict(data))
+            _current_dict_ids[name] = dict_id
+
+def _reload_dictionaries():
+    """Load dictionaries added to the databases since they were opened"""
+    for path in list(_dict_db_paths):
+        conn = sqlite3.connect(path)
+        try:
+            load_dictionaries(conn)
+        finally:
+            conn.close()
+
+def _compressor(dict_id):
+    compressors = _local.__dict__.setdefault("compressors", {})
+    if dict_id not in compressors:
+        compressors[dict_id] = zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_dicts.get(dict_id))
+    return compressors[dict_id]
+
+def _decompressor(dict_id):
+    decompressors = _local.__dict__.setdefault("decompressors", {})
+    if dict_id not in decompressors:
+        if dict_id and dict_id not in _dicts:
+            _reload_dictionaries()
+        if dict_id and dict_id not in _dicts:
+            raise ValueError(f"zstd dictionary {dict_id} is not loaded; open the database with connect_db")
+        decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=_dicts.get(dict_id))
+    return decompressors[dict_id]
+
+def compress(text, dict_name=None):
+    """Compress text with zstd, using the newest dictionary called dict_name if there is one"""
+    if text is None:
+        return None
+    dict_id = _current_dict_ids.get(dict_name, 0) if dict_name else 0
+    return _compressor(dict_id).compress(text.encode())
+
+def decompress(data):
+    """Decompress a value stored by compress(); None stays None"""
+    if data is None:
+        return None
+    dict_id = zstandard.get_frame_parameters(data).dict_id
+    return _decompressor(dict_id).decompress(data).decode()
+
+def register_functions(conn):
+    """Make zstd_decompress(blob) available to SQL, including the triggers and view behind block_fts"""
+    conn.create_function("zstd_decompress", 1, decompress, deterministic=True)
+
+def train_dictionary(conn, name=DICT_NAME, samples=DICT_SAMPLES, dict_size=DICT_SIZE):
+    """
+    Train a zstd dictionary on a sample of block full_json and recompress
+    every block's full_json with it
+    Are.na API responses share most of their keys and structure, which a
+    dictionary captures once instead of in every row.
+    Returns:
+        The new dictionary id, or None if there are too few blocks
+    """
+    rows = conn.execute("""
+        SELECT full_json FROM block_content
+        WHERE full_json IS NOT NULL
+        ORDER BY random()
+        LIMIT ?
+    """, (samples,)).fetchall()
+    if len(rows) < DICT_MIN_SAMPLES:
+        logger.info(f"Only {len(rows)} blocks, not training a {name} dictionary")
+        return None
+    dictionary = zstandard.train_dictionary(dict_size, [decompress(row[0]).encode() for row in rows])
+    dict_id = dictionary.dict_id()
+    init_dict_table(conn)
+    conn.execute('INSERT OR REPLACE INTO zstd_dict (id, name, data) VALUES (?, ?, ?)', (dict_id, name, dictionary.as_bytes()))
+    conn.commit()
+    load_dictionaries(conn)
+
+    before = after = 0
+    last_rowid = 0
+    while True:
+        batch = conn.execute("""
+            SELECT rowid, block_id, full_json FROM block_content
+            WHERE rowid > ? AND full_json IS NOT NULL
+            ORDER BY rowid
+            LIMIT ?
+        """, (last_rowid, RECOMPRESS_BATCH_SIZE)).fetchall()
+        if not batch:
+            break
+        last_rowid = batch[-1][0]
+        data = [(compress(decompress(full_json), name), block_id) for _, block_id, full_json in batch]
+        before += sum(len(row[2]) for row in batch)
+        after += sum(len(row[0]) for row in data)
+        conn.executemany('UPDATE block_content SET full_json = ? WHERE block_id = ?', data)
+        conn.commit()
+    logger.info(f"Trained {name} dictionary {dict_id} on {len(rows)} blocks; full_json {before / 1024 ** 2:.1f}MB -> {after / 1024 ** 2:.1f}MB")
+    return dict_id
+
+def main():
+    # Through the imported module, which holds the dictionaries connect_db loads (not this __main__ copy)
+    import block_storage
+    from arena_utils import connect_db, init_db
+
+    parser = argparse.ArgumentParser(description='Migrate the block store to compressed storage and (re)train its zstd dictionary')
+    parser.add_argument('--db', default='../../store.sqlite3', help='SQLite database (default: ../../store.sqlite3)')
+    parser.add_argument('--train-dict', action='store_true', help='Train a new full_json dictionary and recompress with it')
+    parser.add_argument('--vacuum', action='store_true', help='Reclaim free pages afterwards')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = connect_db(args.db)
+    try:
+        # Migrates an uncompressed database in place
+        init_db(conn)
+        if args.train_dict:
+            block_storage.train_dictionary(conn)
+        if args.vacuum:
+            conn.execute("VACUUM")
+            conn.execute("INSERT INTO block_fts (block_fts) VALUES ('rebuild')")
+            conn.commit()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
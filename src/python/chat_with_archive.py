@@ -1,8 +1,4 @@
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough
-from vector_store import VectorStore
+from query_daemon import get_searcher
 import argparse
 import logging
 import os
@@ -19,15 +15,30 @@ class RAGQueryEngine:
         model_name: str = "gpt-3.5-turbo",
         temperature: float = 0.0,
         max_tokens: int = 500,
-        vector_store: VectorStore = None
+        vector_store=None,
+        use_chunks: bool = False,
+        hybrid: bool = False,
+        db_path: str = "../../store.sqlite3"
     ):
-        """Initialize RAG query engine"""
+        """
+        Initialize RAG query engine, retrieving whole passages if use_chunks is set
+        and fusing vector and keyword (db_path's keyword index) rankings if hybrid is set
+        vector_store defaults to the query daemon if it is running, otherwise a
+        VectorStore in this process
+        """
+        # Imported here so --help and argument errors don't wait on langchain
+        from langchain_openai import ChatOpenAI
+        from langchain.prompts import ChatPromptTemplate
+
         self.llm = ChatOpenAI(
             model_name=model_name,
             temperature=temperature,
             max_tokens=max_tokens
         )
-        self.vector_store = vector_store or VectorStore()
+        self.vector_store = vector_store or get_searcher()
+        self.use_chunks = use_chunks
+        self.hybrid = hybrid
+        self.db_path = db_path
         
         # Setup RAG prompt
         template = """You are a helpful research assistant. Use the following retrieved documents to answer the question. 
@@ -59,11 +70,19 @@ Answer:"""
         
     def retrieve(self, query: str, limit: int = 3) -> str:
         """Retrieve relevant documents"""
-        results = self.vector_store.search(query, limit=limit)
+        if self.hybrid:
+            from hybrid_search import hybrid_search
+
+            results = hybrid_search(self.vector_store, self.db_path, query, limit=limit, chunks=self.use_chunks)
+        else:
+            results = self.vector_store.search(query, limit=limit, chunks=self.use_chunks)
         return self._format_docs(results)
         
     def query(self, question: str, limit: int = 3) -> str:
         """Run RAG query pipeline"""
+        from langchain.schema import StrOutputParser
+        from langchain.schema.runnable import RunnablePassthrough
+
         # Setup RAG chain
         rag_chain = (
             {"context": lambda x: self.retrieve(x, limit=limit), "question": RunnablePassthrough()}
@@ -109,6 +128,21 @@ def main():
         action='store_true',
         help='Enable debug logging'
     )
+    parser.add_argument(
+        '--chunks',
+        action='store_true',
+        help='Retrieve matching passages instead of block previews'
+    )
+    parser.add_argument(
+        '--hybrid',
+        action='store_true',
+        help='Fuse vector and keyword search rankings when retrieving'
+    )
+    parser.add_argument(
+        '--db',
+        default='../../store.sqlite3',
+        help='SQLite database with the keyword index used by --hybrid (default: ../../store.sqlite3)'
+    )
     parser.add_argument(
         '--show-sources',
         action='store_true',
@@ -129,7 +163,10 @@ def main():
         rag = RAGQueryEngine(
             model_name=args.model,
             temperature=args.temperature,
-            max_tokens=args.max_tokens
+            max_tokens=args.max_tokens,
+            use_chunks=args.chunks,
+            hybrid=args.hybrid,
+            db_path=args.db
         )
         
         # Show sources if requested
@@ -0,0 +1,92 @@
+import re
+import logging
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces, roughly 1000 characters of English prose
+CHUNK_MAX_CHARS = 1000
+
+HEADING_RE = re.compile(r'^#{1,6}\s+(.*)$')
+PARAGRAPH_BREAK_RE = re.compile(r'\n\s*\n')
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+
+def _paragraph_spans(text):
+    """Yield (start, end) spans of the paragraphs in text, split on blank lines"""
+    start = 0
+    for match in PARAGRAPH_BREAK_RE.finditer(text):
+        if text[start:match.start()].strip():
+            yield start, match.start()
+        start = match.end()
+    if text[start:].strip():
+        yield start, len(text)
+
+def _split_long_span(text, start, end, max_chars):
+    """Split a span longer than max_chars at sentence boundaries, hard-cutting if needed"""
+    if end - start <= max_chars:
+        return [(start, end)]
+
+    sentences = []
+    sentence_start = start
+    for match in SENTENCE_END_RE.finditer(text, start, end):
+        sentences.append((sentence_start, match.start()))
+        sentence_start = match.end()
+    sentences.append((sentence_start, end))
+
+    pieces = []
+    for sentence_start, sentence_end in sentences:
+        # Hard cut sentences that are too long on their own (tables, unpunctuated text)
+        while sentence_end - sentence_start > max_chars:
+            pieces.append((sentence_start, sentence_start + max_chars))
+            sentence_start += max_chars
+        if pieces and sentence_end - pieces[-1][0] <= max_chars:
+            pieces[-1] = (pieces[-1][0], sentence_end)
+        elif sentence_end > sentence_start:
+            pieces.append((sentence_start, sentence_end))
+    return pieces
+
+def chunk_markdown(markdown_text: Optional[str], max_chars: int = CHUNK_MAX_CHARS) -> List[dict]:
+    """
+    Split markdown (as produced by parse_utils.clean_markdown) into passages
+    Paragraphs are packed into chunks of at most max_chars, a heading always
+    starts a new chunk, and oversized paragraphs are split at sentence ends.
+    Args:
+        markdown_text: Markdown body of a block
+        max_chars: Maximum characters per chunk
+    Returns:
+        List of dicts with chunk_index, offset (into markdown_text), text and heading
+    """
+    if not markdown_text:
+        return []
+
+    chunks = []
+    heading = None
+    current = None  # [start, end, heading]
+
+    def flush():
+        if current is not None:
+            chunks.append({
+                "chunk_index": len(chunks),
+                "offset": current[0],
+                "text": markdown_text[current[0]:current[1]],
+                "heading": current[2],
+            })
+
+    for start, end in _paragraph_spans(markdown_text):
+        first_line = markdown_text[start:end].strip().split('\n', 1)[0]
+        heading_match = HEADING_RE.match(first_line)
+        if heading_match:
+            flush()
+            current = None
+            heading = heading_match.group(1).strip()
+
+        for piece_start, piece_end in _split_long_span(markdown_text, start, end, max_chars):
+            if current is not None and piece_end - current[0] <= max_chars:
+                current[1] = piece_end
+            else:
+                flush()
+                current = [piece_start, piece_end, heading]
+    flush()
+
+    logger.debug(f"Split {len(markdown_text)} chars into {len(chunks)} chunks")
+    return chunks
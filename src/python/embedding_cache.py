@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', '../../embedding_cache.sqlite3')
+LOOKUP_BATCH_SIZE = 500  # stays well under SQLite's bound variable limit
+
+def text_hash(text: str) -> str:
+    """Hash of text with whitespace runs collapsed, so re-crawls that only reflow text still hit"""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    Persistent cache of embeddings keyed by (model name, normalized text hash)
+    Vectors are stored as packed float32 blobs in SQLite.
+    """
+    def __init__(self, model_name: str, path: str = EMBEDDING_CACHE_PATH):
+        self.model_name = model_name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS "embedding_cache" (
+          model_name          string,
+          text_hash           string,
+          vector              BLOB,
+          created_at          timestamp DEFAULT CURRENT_TIMESTAMP,
+          PRIMARY KEY (model_name, text_hash)
+        );
+        """)
+        self._conn.commit()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Get cached embeddings for texts, with None for texts not in the cache"""
+        hashes = [text_hash(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+                batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+                placeholders = ','.join('?' * len(batch))
+                rows = self._conn.execute(f"""
+                    SELECT text_hash, vector
+                    FROM embedding_cache
+                    WHERE model_name = ? AND text_hash IN ({placeholders})
+                """, [self.model_name, *batch]).fetchall()
+                found.update(rows)
+
+        embeddings = []
+        for hash_ in hashes:
+            if hash_ in found:
+                vector = array('f')
+                vector.frombytes(found[hash_])
+                embeddings.append(vector.tolist())
+            else:
+                embeddings.append(None)
+        return embeddings
+
+    def put_many(self, texts: List[str], embeddings: List[List[float]]):
+        """Store embeddings for texts"""
+        rows = [
+            (self.model_name, text_hash(text), array('f', embedding).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        with self._lock:
+            self._conn.executemany("""
+            INSERT OR REPLACE INTO embedding_cache (model_name, text_hash, vector)
+            VALUES (?, ?, ?)
+            """, rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,163 @@
+import argparse
+import logging
+import os
+import secrets
+import threading
+from multiprocessing.connection import Client, Listener
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_SERVER_SOCKET = os.getenv('EMBEDDING_SERVER_SOCKET', '../../embedding.sock')
+EMBEDDING_SERVER_AUTHKEY = os.getenv('EMBEDDING_SERVER_AUTHKEY')
+# Shared secret of the local servers when no authkey is configured, created readable only by this user
+AUTHKEY_PATH = os.getenv('AUTHKEY_PATH', os.path.expanduser('~/.archive-knowledge-base/authkey'))
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+
+def load_authkey(authkey=None, path=AUTHKEY_PATH):
+    """
+    Get the key authenticating clients of the local servers: authkey if
+    given, else the per-user secret in path, generated on first use
+    """
+    if authkey:
+        return authkey.encode() if isinstance(authkey, str) else authkey
+    os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    key = secrets.token_hex(32).encode()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+class EmbeddingServer:
+    """
+    Long-lived process owning one copy of a sentence-transformer model,
+    serving encode requests over a Unix socket
+    Each client connection gets a thread; forward passes are serialized on
+    the model.
+    """
+    def __init__(self, model_name=DEFAULT_MODEL, address=EMBEDDING_SERVER_SOCKET, authkey=EMBEDDING_SERVER_AUTHKEY):
+        from sentence_transformers import SentenceTransformer
+
+        logger.info(f"Loading embedding model: {model_name}")
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self.address = address
+        self.authkey = load_authkey(authkey)
+        self._model_lock = threading.Lock()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    op = request.get("op")
+                    if op == "encode":
+                        with self._model_lock:
+                            result = self.model.encode(request["texts"], batch_size=request.get("batch_size", 32))
+                    elif op == "info":
+                        result = {"model_name": self.model_name, "dimension": self.dimension}
+                    else:
+                        raise ValueError(f"Unknown operation: {op}")
+                    conn.send({"ok": True, "result": result})
+                except Exception as e:
+                    logger.error(f"Embedding request failed: {e}")
+                    conn.send({"ok": False, "error": f"{type(e).__name__}: {e}"})
+
+    def serve_forever(self):
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with Listener(self.address, family='AF_UNIX', authkey=self.authkey) as listener:
+            os.chmod(self.address, 0o600)
+            logger.info(f"Embedding server listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    # Failed handshakes (e.g. wrong authkey) must not take the server down
+                    logger.warning(f"Rejected embedding client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+class RemoteEncoder:
+    """
+    Client for an EmbeddingServer, usable in place of a SentenceTransformer
+    by VectorStore (only encode is supported)
+    Each thread keeps its own connection, so concurrent callers don't
+    interleave messages. Once expect_model() is called, every new connection
+    checks that the server runs that model, since vectors from another model
+    would silently corrupt the index.
+    """
+    def __init__(self, address=EMBEDDING_SERVER_SOCKET, authkey=EMBEDDING_SERVER_AUTHKEY):
+        self.address = address
+        self.authkey = load_authkey(authkey)
+        self.expected_model = None
+        self._local = threading.local()
+
+    def expect_model(self, model_name, dimension):
+        """Require the server to run model_name, producing dimension-sized vectors"""
+        self.expected_model = (model_name, dimension)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+            if self.expected_model:
+                self._check_model(conn)
+            self._local.conn = conn
+        return conn
+
+    def _check_model(self, conn):
+        conn.send({"op": "info"})
+        response = conn.recv()
+        info = response["result"] if response["ok"] else {}
+        served = (info.get("model_name"), info.get("dimension"))
+        if served != self.expected_model:
+            conn.close()
+            raise ValueError(
+                f"Embedding server at {self.address} serves {served[0]} ({served[1]} dimensions), "
+                f"expected {self.expected_model[0]} ({self.expected_model[1]} dimensions)"
+            )
+
+    def _call(self, request):
+        for attempt in range(2):
+            try:
+                conn = self._connection()
+                conn.send(request)
+                response = conn.recv()
+                break
+            except (EOFError, OSError):
+                # The server restarted since this thread connected; reconnect once
+                self._local.conn = None
+                if attempt:
+                    raise
+        if not response["ok"]:
+            raise RuntimeError(f"Embedding server error: {response['error']}")
+        return response["result"]
+
+    def encode(self, texts, batch_size=32, **kwargs):
+        """Encode texts on the server, returning a numpy array like SentenceTransformer.encode"""
+        return self._call({"op": "encode", "texts": list(texts), "batch_size": batch_size})
+
+    def info(self):
+        """Get the server's model_name and dimension"""
+        return self._call({"op": "info"})
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve a sentence-transformer model to other processes over a Unix socket')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Sentence-transformer model to load')
+    parser.add_argument('--socket', default=EMBEDDING_SERVER_SOCKET, help='Unix socket path to listen on')
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    EmbeddingServer(model_name=args.model, address=args.socket).serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+import http_client
+
+logger = logging.getLogger(__name__)
+
+HTTP_CACHE_PATH = os.getenv('HTTP_CACHE_PATH', '../../http_cache.sqlite3')
+MAX_CACHE_BYTES = 2 * 1024 ** 3      # total compressed bodies kept before LRU eviction
+MAX_ENTRY_BYTES = 100 * 1024 ** 2    # larger responses are passed through uncached
+MAX_AGE = 7 * 24 * 3600              # seconds an entry is served without revalidating
+CACHED_HEADERS = ('content-type', 'etag', 'last-modified')
+
+class OfflineCacheMiss(requests.RequestException):
+    """Raised in offline mode when a URL is not in the cache"""
+
+class HTTPCache:
+    """
+    On-disk cache of GET response bodies keyed by URL
+    Bodies are stored zlib-compressed in SQLite with their ETag and
+    Last-Modified headers. Entries younger than max_age are served without
+    touching the network, older ones are revalidated with a conditional GET,
+    and the least recently used entries are evicted past max_bytes.
+    """
+    def __init__(
+        self,
+        path=HTTP_CACHE_PATH,
+        max_bytes=MAX_CACHE_BYTES,
+        max_entry_bytes=MAX_ENTRY_BYTES,
+        max_age=MAX_AGE,
+        offline=False,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.max_age = max_age
+        self.offline = offline
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+        CREATE TABLE IF NOT EXISTS "http_cache" (
+          url                 string primary key,
+          headers             TEXT,
+          body                BLOB,
+          size                integer,
+          fetched_at          real,
+          accessed_at         real
+        );
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS http_cache_accessed_at ON http_cache (accessed_at)')
+        self._conn.commit()
+
+    def _lookup(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT headers, body, fetched_at FROM http_cache WHERE url = ?', (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"headers": json.loads(row[0]), "body": row[1], "fetched_at": row[2]}
+
+    def _touch(self, url, revalidated=False):
+        now = time.time()
+        with self._lock:
+            if revalidated:
+                self._conn.execute('UPDATE http_cache SET accessed_at = ?, fetched_at = ? WHERE url = ?', (now, now, url))
+            else:
+                self._conn.execute('UPDATE http_cache SET accessed_at = ? WHERE url = ?', (now, url))
+            self._conn.commit()
+
+    def _store(self, url, response):
+        headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+        body = zlib.compress(response.content)
+        now = time.time()
+        with self._lock:
+            self._conn.execute("""
+            INSERT INTO http_cache (url, headers, body, size, fetched_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (url) DO UPDATE SET
+              headers = excluded.headers,
+              body = excluded.body,
+              size = excluded.size,
+              fetched_at = excluded.fetched_at,
+              accessed_at = excluded.accessed_at
+            """, (url, json.dumps(headers), body, len(body), now, now))
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        total = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM http_cache').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for url, size in self._conn.execute('SELECT url, size FROM http_cache ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute('DELETE FROM http_cache WHERE url = ?', (url,))
+            total -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} entries from HTTP cache")
+
+    def _response(self, url, entry):
+        """Rebuild a requests.Response from a cache entry"""
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict(entry["headers"])
+        response.encoding = get_encoding_from_headers(response.headers)
+        response._content = zlib.decompress(entry["body"])
+        return response
+
+    def get(self, url, timeout=http_client.DEFAULT_TIMEOUT):
+        """GET a URL, serving it from the cache when fresh or unchanged"""
+        entry = self._lookup(url)
+
+        if entry is not None and (self.offline or time.time() - entry["fetched_at"] < self.max_age):
+            logger.debug(f"HTTP cache hit: {url}")
+            self._touch(url)
+            return self._response(url, entry)
+        if self.offline:
+            raise OfflineCacheMiss(f"{url} is not cached and offline mode is enabled")
+
+        headers = {}
+        if entry is not None:
+            if "etag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["etag"]
+            if "last-modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+
+        response = http_client.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            logger.debug(f"HTTP cache revalidated: {url}")
+            self._touch(url, revalidated=True)
+            return self._response(url, entry)
+
+        if response.status_code == 200 and len(response.content) <= self.max_entry_bytes:
+            self._store(url, response)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_cache = None
+_cache_enabled = True
+_cache_lock = threading.Lock()
+
+def configure_cache(enabled=True, **kwargs):
+    """Replace the shared cache with HTTPCache(**kwargs), or disable caching"""
+    global _cache, _cache_enabled
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+        _cache_enabled = enabled
+        _cache = HTTPCache(**kwargs) if enabled else None
+        return _cache
+
+def get_cache():
+    """Get the shared cache, creating it with defaults on first use (None if disabled)"""
+    global _cache
+    if _cache is None and _cache_enabled:
+        with _cache_lock:
+            if _cache is None and _cache_enabled:
+                _cache = HTTPCache()
+    return _cache
+
+def get(url, timeout=http_client.DEFAULT_TIMEOUT):
+    """GET a URL through the shared cache, or straight through http_client if disabled"""
+    cache = get_cache()
+    if cache is None:
+        return http_client.get(url, timeout=timeout)
+    return cache.get(url, timeout=timeout)
@@ -0,0 +1,129 @@
+import requests
+import logging
+import threading
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the shared session
+POOL_CONNECTIONS = 32        # number of per-host connection pools kept alive
+POOL_MAXSIZE = 16            # connections kept alive per host
+RETRIES = 5                  # retries on retryable statuses
+CONNECT_RETRIES = 1          # retries on connection errors and timeouts, which each cost up to DEFAULT_TIMEOUT
+READ_RETRIES = 1
+BACKOFF_FACTOR = 0.5         # sleeps 0.5s, 1s, 2s, ... between retries
+BACKOFF_MAX = 30             # longest sleep between retries
+RETRY_AFTER_MAX = 60         # longer Retry-After headers are cut to this many seconds
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+DEFAULT_TIMEOUT = 10
+MAX_DOWNLOAD_BYTES = 100 * 1024 ** 2  # responses larger than this are abandoned mid-stream
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+USER_AGENT = "archive-knowledge-base/0.1 (+https://github.com/suruleredotdev/archive-knowledge-base)"
+
+_session = None
+_session_lock = threading.Lock()
+_max_download_bytes = MAX_DOWNLOAD_BYTES
+
+class ResponseTooLarge(requests.RequestException):
+    """Raised when a response body exceeds the download size cutoff"""
+
+class CappedRetry(Retry):
+    """Retry that waits at most RETRY_AFTER_MAX seconds for a Retry-After header"""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, RETRY_AFTER_MAX)
+
+def create_session(
+    pool_connections=POOL_CONNECTIONS,
+    pool_maxsize=POOL_MAXSIZE,
+    retries=RETRIES,
+    connect_retries=CONNECT_RETRIES,
+    read_retries=READ_RETRIES,
+    backoff_factor=BACKOFF_FACTOR,
+    user_agent=USER_AGENT,
+):
+    """
+    Build a requests session with keep-alive connection pools, compressed
+    transfer and retries with exponential backoff on 429/5xx responses,
+    honouring Retry-After headers up to RETRY_AFTER_MAX seconds
+    Connection errors and timeouts are retried only connect_retries and
+    read_retries times, so a dead host fails fast.
+    """
+    retry = CappedRetry(
+        total=None,
+        status=retries,
+        connect=connect_retries,
+        read=read_retries,
+        other=0,
+        backoff_factor=backoff_factor,
+        backoff_max=BACKOFF_MAX,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,  # hand the last response back so callers can raise_for_status
+    )
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    # Advertises gzip/deflate, plus br when the brotli package is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    session.headers["User-Agent"] = user_agent
+    return session
+
+def configure_session(max_download_bytes=MAX_DOWNLOAD_BYTES, **kwargs):
+    """
+    Replace the shared session with one built from create_session(**kwargs)
+    and set the download size cutoff used by get()
+    """
+    global _session, _max_download_bytes
+    with _session_lock:
+        _max_download_bytes = max_download_bytes
+        if _session is not None:
+            _session.close()
+        _session = create_session(**kwargs)
+        logger.debug(f"Configured shared HTTP session: {kwargs}")
+        return _session
+
+def get_session():
+    """Get the shared session, creating it with defaults on first use"""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = create_session()
+    return _session
+
+def read_body(response, max_bytes=None):
+    """
+    Read a streamed response body into memory, closing the connection and
+    raising ResponseTooLarge as soon as it exceeds max_bytes
+    """
+    max_bytes = max_bytes or _max_download_bytes
+    content_length = response.headers.get('content-length', '')
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        response.close()
+        raise ResponseTooLarge(f"{response.url} is {content_length} bytes, over the {max_bytes} byte cutoff")
+
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+        size += len(chunk)
+        if size > max_bytes:
+            response.close()
+            raise ResponseTooLarge(f"{response.url} exceeded the {max_bytes} byte cutoff")
+        chunks.append(chunk)
+
+    # Make .content/.text/.json() serve the buffered body
+    response._content = b''.join(chunks)
+    response._content_consumed = True
+    return response._content
+
+def get(url, timeout=DEFAULT_TIMEOUT, max_bytes=None, **kwargs):
+    """GET a URL through the shared session, streaming the body up to max_bytes"""
+    response = get_session().get(url, timeout=timeout, stream=True, **kwargs)
+    read_body(response, max_bytes)
+    return response
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from arena_utils import connect_db, keyword_search
+
+logger = logging.getLogger(__name__)
+
+# Constant damping the weight of top ranks in reciprocal rank fusion (from the original RRF paper)
+RRF_K = 60
+# Results fetched from each leg before fusing, so blocks ranked modestly by both can surface
+HYBRID_CANDIDATES = 20
+# Keyword-only hits have no vector preview, so give them a longer snippet
+KEYWORD_SNIPPET_TOKENS = 64
+
+def reciprocal_rank_fusion(results_by_source: Dict[str, List[dict]], limit: int, k: int = RRF_K) -> List[dict]:
+    """
+    Fuse ranked result lists by summing 1 / (k + rank) per block
+    The first source's result dict is kept for blocks found by several
+    sources, with score replaced by the fused score and the rank in each
+    source recorded under "ranks".
+    """
+    fused = {}
+    for source, results in results_by_source.items():
+        for rank, result in enumerate(results, 1):
+            # SQLite returns numeric Are.na ids as integers, Qdrant payloads may hold strings
+            key = str(result["block_id"])
+            if key not in fused:
+                fused[key] = {**result, "score": 0.0, "ranks": {}}
+            fused[key]["score"] += 1.0 / (k + rank)
+            fused[key]["ranks"][source] = rank
+    return sorted(fused.values(), key=lambda result: result["score"], reverse=True)[:limit]
+
+def _keyword_leg(db_path: str, query: str, candidates: int) -> List[dict]:
+    # Own connection: this runs on a worker thread
+    conn = connect_db(db_path)
+    try:
+        return keyword_search(conn, query, limit=candidates, match_all=False, snippet_tokens=KEYWORD_SNIPPET_TOKENS)
+    finally:
+        conn.close()
+
+def hybrid_search(
+    vector_store,
+    db_path: str,
+    query: str,
+    limit: int = 5,
+    chunks: bool = False,
+    candidates: int = HYBRID_CANDIDATES,
+) -> List[dict]:
+    """
+    Search with Qdrant and the SQLite keyword index in parallel and fuse the
+    rankings with reciprocal rank fusion
+    Args:
+        vector_store: Anything with VectorStore.search (a VectorStore or a
+            query daemon client)
+        db_path: SQLite database holding the block_fts keyword index
+        query: Text query to search for
+        limit: Maximum number of results to return
+        chunks: Use passage search for the vector leg
+        candidates: Results taken from each leg before fusing
+    Returns:
+        List of blocks with their fused scores
+    """
+    candidates = max(limit, candidates)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        vector_future = executor.submit(vector_store.search, query, limit=candidates, chunks=chunks)
+        keyword_future = executor.submit(_keyword_leg, db_path, query, candidates)
+        results_by_source = {"vector": vector_future.result(), "keyword": keyword_future.result()}
+    return reciprocal_rank_fusion(results_by_source, limit)
+
+async def async_hybrid_search(
+    vector_store,
+    db_path: str,
+    query: str,
+    limit: int = 5,
+    chunks: bool = False,
+    candidates: int = HYBRID_CANDIDATES,
+    encode: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+) -> List[dict]:
+    """hybrid_search() for use on an event loop, encoding the query with `encode` (see VectorStore.async_search)"""
+    candidates = max(limit, candidates)
+    vector_results, keyword_results = await asyncio.gather(
+        vector_store.async_search(query, limit=candidates, chunks=chunks, encode=encode),
+        asyncio.to_thread(_keyword_leg, db_path, query, candidates),
+    )
+    return reciprocal_rank_fusion({"vector": vector_results, "keyword": keyword_results}, limit)
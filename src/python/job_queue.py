@@ -0,0 +1,235 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from uuid import uuid4
+
+from arena_utils import connect_db
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 30          # seconds before the first retry, doubling per attempt
+LEASE_SECONDS = 15 * 60     # running jobs older than this are assumed orphaned by a dead worker
+POLL_INTERVAL = 1.0
+
+class PermanentJobError(Exception):
+    """A job failure that retrying cannot fix; the job fails without further attempts"""
+
+def init_job_queue(conn):
+    """Create the ingestion job table"""
+    cur = conn.cursor()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS "ingest_job" (
+      id                  string primary key,
+      kind                string,
+      block_id            string,
+      payload             TEXT,
+      status              string DEFAULT 'queued',
+      attempts            integer DEFAULT 0,
+      next_run_at         real,
+      claimed_at          real,
+      last_error          string,
+      created_at          timestamp DEFAULT CURRENT_TIMESTAMP,
+      updated_at          timestamp DEFAULT CURRENT_TIMESTAMP
+    );
+    """)
+    cur.execute('CREATE INDEX IF NOT EXISTS ingest_job_status_next_run_at ON ingest_job (status, next_run_at)')
+    conn.commit()
+
+def _job_from_row(row):
+    return {
+        "job_id": row[0],
+        "kind": row[1],
+        "block_id": row[2],
+        "payload": json.loads(row[3]) if row[3] else {},
+        "status": row[4],
+        "attempts": row[5],
+        "error": row[6],
+        "created_at": row[7],
+        "updated_at": row[8],
+    }
+
+JOB_COLUMNS = "id, kind, block_id, payload, status, attempts, last_error, created_at, updated_at"
+
+def enqueue_job(conn, kind, block_id, payload):
+    """Add a job to the queue, returning its id"""
+    return enqueue_jobs(conn, kind, [(block_id, payload)])[0]
+
+def enqueue_jobs(conn, kind, items):
+    """
+    Add jobs to the queue in one transaction
+    Args:
+        items: List of (block_id, payload) tuples
+    Returns:
+        List of job ids, in the order of items
+    """
+    now = time.time()
+    job_ids = [uuid4().hex for _ in items]
+    conn.executemany("""
+    INSERT INTO ingest_job (id, kind, block_id, payload, next_run_at) VALUES (?, ?, ?, ?, ?)
+    """, [(job_id, kind, block_id, json.dumps(payload), now) for job_id, (block_id, payload) in zip(job_ids, items)])
+    conn.commit()
+    return job_ids
+
+def get_job(conn, job_id):
+    """Get a job by id, or None"""
+    row = conn.execute(f"SELECT {JOB_COLUMNS} FROM ingest_job WHERE id = ?", (job_id,)).fetchone()
+    return _job_from_row(row) if row else None
+
+def get_jobs(conn, job_ids, batch_size=500):
+    """Get job_id -> job for the given ids that exist"""
+    job_ids = list(job_ids)
+    jobs = {}
+    for start in range(0, len(job_ids), batch_size):
+        batch = job_ids[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(f"SELECT {JOB_COLUMNS} FROM ingest_job WHERE id IN ({placeholders})", batch):
+            jobs[row[0]] = _job_from_row(row)
+    return jobs
+
+def get_active_url_jobs(conn, urls, batch_size=500):
+    """Get url -> job for URL jobs that are queued or running"""
+    urls = list(urls)
+    jobs = {}
+    for start in range(0, len(urls), batch_size):
+        batch = urls[start:start + batch_size]
+        placeholders = ','.join('?' * len(batch))
+        for row in conn.execute(f"""
+        SELECT {JOB_COLUMNS} FROM ingest_job
+        WHERE kind = 'url' AND status IN ('queued', 'running') AND json_extract(payload, '$.url') IN ({placeholders})
+        """, batch):
+            job = _job_from_row(row)
+            jobs[job["payload"]["url"]] = job
+    return jobs
+
+def claim_jobs(conn, limit, lease_seconds=LEASE_SECONDS):
+    """
+    Atomically claim up to `limit` runnable jobs for this worker
+    Runnable jobs are queued ones whose retry time has come, and running ones
+    whose lease expired because the worker holding them died.
+    """
+    now = time.time()
+    rows = conn.execute(f"""
+    UPDATE ingest_job
+    SET status = 'running', attempts = attempts + 1, claimed_at = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id IN (
+      SELECT id FROM ingest_job
+      WHERE (status = 'queued' AND next_run_at <= ?)
+         OR (status = 'running' AND claimed_at <= ?)
+      ORDER BY next_run_at
+      LIMIT ?
+    )
+    RETURNING {JOB_COLUMNS}
+    """, (now, now, now - lease_seconds, limit)).fetchall()
+    conn.commit()
+    return [_job_from_row(row) for row in rows]
+
+def complete_jobs(conn, job_ids):
+    """Mark jobs as done"""
+    conn.executemany("""
+    UPDATE ingest_job SET status = 'done', last_error = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?
+    """, [(job_id,) for job_id in job_ids])
+    conn.commit()
+
+def fail_job(conn, job, error, max_attempts=MAX_ATTEMPTS, retry_backoff=RETRY_BACKOFF):
+    """
+    Record a failed attempt, re-queueing the job with exponential backoff
+    until it has been tried max_attempts times or fails with a PermanentJobError
+    Returns:
+        True if the job will be retried
+    """
+    retry = job["attempts"] < max_attempts and not isinstance(error, PermanentJobError)
+    conn.execute("""
+    UPDATE ingest_job
+    SET status = ?, next_run_at = ?, last_error = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    """, (
+        'queued' if retry else 'failed',
+        time.time() + retry_backoff * 2 ** (job["attempts"] - 1),
+        str(error),
+        job["job_id"],
+    ))
+    conn.commit()
+    return retry
+
+class JobWorkerPool:
+    """
+    Threads that claim batches of jobs from the queue and hand them to
+    process_batch(conn, jobs), which returns a dict of job_id -> error for
+    jobs that failed (missing ids count as successes). on_finished(job) is
+    called once a job is done or has permanently failed.
+    """
+    def __init__(
+        self,
+        db_path,
+        process_batch,
+        num_workers=2,
+        batch_size=16,
+        max_attempts=MAX_ATTEMPTS,
+        poll_interval=POLL_INTERVAL,
+        on_finished=None,
+    ):
+        self.db_path = db_path
+        self.process_batch = process_batch
+        self.on_finished = on_finished
+        self.num_workers = num_workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i in range(self.num_workers):
+            thread = threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"Started {self.num_workers} ingestion workers")
+
+    def notify(self):
+        """Wake idle workers, e.g. right after enqueueing"""
+        self._wakeup.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _run(self):
+        conn = connect_db(self.db_path)
+        try:
+            while not self._stop.is_set():
+                try:
+                    claimed = claim_jobs(conn, self.batch_size)
+                except sqlite3.Error as e:
+                    logger.error(f"Failed to claim ingestion jobs: {e}")
+                    claimed = []
+                if not claimed:
+                    self._wakeup.wait(self.poll_interval)
+                    self._wakeup.clear()
+                    continue
+                self._process(conn, claimed)
+        finally:
+            conn.close()
+
+    def _process(self, conn, claimed):
+        logger.debug(f"Processing {len(claimed)} ingestion jobs")
+        try:
+            errors = self.process_batch(conn, claimed) or {}
+        except Exception as e:
+            logger.error(f"Ingestion batch failed: {e}", exc_info=True)
+            errors = {job["job_id"]: e for job in claimed}
+
+        complete_jobs(conn, [job["job_id"] for job in claimed if job["job_id"] not in errors])
+        for job in claimed:
+            finished = True
+            if job["job_id"] in errors:
+                finished = not fail_job(conn, job, errors[job["job_id"]], max_attempts=self.max_attempts)
+                logger.warning(f"Ingestion job {job['job_id']} failed ({'giving up' if finished else 'retrying'}): {errors[job['job_id']]}")
+            if finished and self.on_finished:
+                self.on_finished(job)
@@ -0,0 +1,417 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import threading
+from collections import namedtuple
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+logger = logging.getLogger(__name__)
+
+INITIAL_CAPACITY = 1024     # rows allocated in a new vectors file; it doubles when full
+COMPACT_RATIO = 0.5         # rewrite the files once this fraction of rows are tombstoned
+QUANTIZATIONS = ("int8", "binary")
+RESCORE_OVERSAMPLING = 3.0  # quantized candidates fetched per requested result, then rescored in float32
+INT8_QUANTILE = 0.999       # int8 scale maps this quantile of |component| to 127; larger values clip
+SCORE_BLOCK_ROWS = 8192     # rows dequantized at a time when scoring, bounding temporary memory
+
+SearchHit = namedtuple("SearchHit", ["id", "score", "payload"])
+
+class _PointsReader:
+    """Read handle on a points file, closed once the index and every search using it have released it"""
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._refs = 1
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._refs -= 1
+            if self._refs == 0:
+                self._file.close()
+
+    def read(self, offset, length):
+        return os.pread(self._file.fileno(), length, offset)
+
+class NumpyIndex:
+    """
+    Exact cosine index over one collection, stored in a directory as
+    - vectors.<n>.npy: memory-mapped float32 matrix of normalized vectors,
+      with spare capacity for appends
+    - points.<n>.jsonl: one {"id", "payload"} line per row, in row order
+    - tombstones.<n>.txt: numbers of deleted rows, one per line
+    - manifest.json: names of the current files, replaced atomically
+    Upserts append rows and tombstone the row previously holding the id.
+    Only ids, block ids and file offsets are kept in memory; payloads are
+    read from disk for the hits. Like local Qdrant storage, an index must
+    only be written by one process.
+
+    With quantization "int8" (1 byte per dimension) or "binary" (1 bit per
+    dimension), search scans a quantized copy of the vectors held in memory
+    and rescores the best limit * rescore_oversampling candidates against
+    the float32 vectors, so only those rows of the memory map are read.
+    """
+    def __init__(
+        self,
+        path: str,
+        vector_size: int,
+        quantization: Optional[str] = None,
+        rescore_oversampling: float = RESCORE_OVERSAMPLING,
+    ):
+        if quantization is not None and quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization: {quantization}")
+        self.path = path
+        self.vector_size = vector_size
+        self.quantization = quantization
+        self.rescore_oversampling = rescore_oversampling
+        self._int8_scale = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        manifest_path = self._file("manifest.json")
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {"version": 0}
+            self._new_files(INITIAL_CAPACITY)
+            self._write_manifest()
+
+        self._vectors = np.load(self._file(self._manifest["vectors"]), mmap_mode="r+")
+        if self._vectors.shape[1] != self.vector_size:
+            raise ValueError(f"Index at {self.path} has {self._vectors.shape[1]}-d vectors, expected {self.vector_size}")
+
+        self._ids, self._block_ids, self._offsets, self._lengths = [], [], [], []
+        points_path = self._file(self._manifest["points"])
+        with open(points_path, "rb") as f:
+            offset = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # torn write from a crash; dropped below
+                point = json.loads(line)
+                self._ids.append(point["id"])
+                self._block_ids.append(point["payload"].get("block_id"))
+                self._offsets.append(offset)
+                self._lengths.append(len(line))
+                offset += len(line)
+        with open(points_path, "r+b") as f:
+            f.truncate(offset)
+        self._points_size = offset
+        self._count = len(self._ids)
+
+        self._alive = np.zeros(len(self._vectors), dtype=bool)
+        self._alive[:self._count] = True
+        with open(self._file(self._manifest["tombstones"])) as f:
+            dead = [int(line) for line in f if line.strip()]
+        self._alive[dead] = False
+        # A crash between appending points and tombstoning the rows they replaced
+        # leaves two live rows for an id; the later one wins
+        latest_row_by_id = {}
+        duplicates = []
+        for row in np.flatnonzero(self._alive):
+            previous = latest_row_by_id.get(self._ids[row])
+            if previous is not None:
+                duplicates.append(previous)
+            latest_row_by_id[self._ids[row]] = int(row)
+        self._alive[duplicates] = False
+        self._dead = int(self._count - self._alive.sum())
+
+        self._row_by_id = {}
+        self._rows_by_block_id = {}
+        for row in np.flatnonzero(self._alive):
+            self._index_row(int(row))
+        self._build_quantized()
+
+        self._reader = _PointsReader(points_path)
+        self._appender = open(points_path, "ab")
+        self._tombstone_writer = open(self._file(self._manifest["tombstones"]), "a")
+        if duplicates:
+            self._tombstone_writer.write("".join(f"{row}\n" for row in duplicates))
+            self._tombstone_writer.flush()
+        logger.debug(f"Loaded {self._count - self._dead} vectors from {self.path}")
+
+    def _new_files(self, capacity):
+        """Allocate the next version's files and make them current (the caller writes the manifest), returning the vectors"""
+        version = self._manifest["version"] + 1
+        manifest = {
+            "version": version,
+            "vectors": f"vectors.{version}.npy",
+            "points": f"points.{version}.jsonl",
+            "tombstones": f"tombstones.{version}.txt",
+        }
+        vectors = open_memmap(self._file(manifest["vectors"]), mode="w+", dtype=np.float32, shape=(capacity, self.vector_size))
+        open(self._file(manifest["points"]), "wb").close()
+        open(self._file(manifest["tombstones"]), "w").close()
+        self._manifest = manifest
+        return vectors
+
+    def _write_manifest(self):
+        tmp_path = self._file("manifest.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._file("manifest.json"))
+
+    def _remove_files(self, manifest):
+        for key in ("vectors", "points", "tombstones"):
+            os.unlink(self._file(manifest[key]))
+
+    def _build_quantized(self):
+        """Quantize all stored vectors, refitting the int8 scale to the live rows"""
+        self._quantized = None
+        if self.quantization is None:
+            return
+        width = self.vector_size if self.quantization == "int8" else (self.vector_size + 7) // 8
+        dtype = np.int8 if self.quantization == "int8" else np.uint8
+        self._quantized = np.zeros((len(self._vectors), width), dtype=dtype)
+        if self.quantization == "int8":
+            live = np.flatnonzero(self._alive[:self._count])
+            self._int8_scale = self._fit_int8_scale(self._vectors[live]) if len(live) else None
+        for start in range(0, self._count, SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, self._count)
+            self._quantized[start:end] = self._quantize(np.asarray(self._vectors[start:end]))
+
+    @staticmethod
+    def _fit_int8_scale(vectors):
+        return 127.0 / max(float(np.quantile(np.abs(vectors), INT8_QUANTILE)), 1e-6)
+
+    def _quantize(self, vectors):
+        if self.quantization == "int8":
+            return np.clip(np.rint(vectors * self._int8_scale), -127, 127).astype(np.int8)
+        return np.packbits(vectors > 0, axis=1)
+
+    def _approximate_scores(self, quantized, count, query):
+        """Score the first `count` quantized rows against a float32 query"""
+        scores = np.empty(count, dtype=np.float32)
+        # Binary rows hold signs: sum(q_i * (2 * bit_i - 1)) = 2 * (bits . q) - sum(q)
+        query_sum = float(query.sum())
+        for start in range(0, count, SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, count)
+            if self.quantization == "int8":
+                scores[start:end] = quantized[start:end].astype(np.float32) @ query
+            else:
+                bits = np.unpackbits(quantized[start:end], axis=1, count=self.vector_size).astype(np.float32)
+                scores[start:end] = 2 * (bits @ query) - query_sum
+        return scores
+
+    def search_memory_bytes(self) -> int:
+        """Bytes of vector data scanned per search: the quantized copy, or the whole float32 matrix"""
+        if self._quantized is not None:
+            return self._quantized[:self._count].nbytes
+        return self._vectors[:self._count].nbytes
+
+    def _index_row(self, row):
+        self._row_by_id[self._ids[row]] = row
+        self._rows_by_block_id.setdefault(self._block_ids[row], set()).add(row)
+
+    def _grow(self, needed):
+        """Move vectors to a file with room for `needed` rows"""
+        capacity = len(self._vectors)
+        while capacity < needed:
+            capacity *= 2
+        old_manifest = dict(self._manifest)
+        manifest = dict(old_manifest, version=old_manifest["version"] + 1, vectors=f"vectors.{old_manifest['version'] + 1}.npy")
+        vectors = open_memmap(self._file(manifest["vectors"]), mode="w+", dtype=np.float32, shape=(capacity, self.vector_size))
+        vectors[:self._count] = self._vectors[:self._count]
+        vectors.flush()
+        self._manifest = manifest
+        self._write_manifest()
+        # Searches holding the old matrix keep it mapped until they finish
+        self._vectors = vectors
+        self._alive = np.concatenate([self._alive, np.zeros(capacity - len(self._alive), dtype=bool)])
+        if self._quantized is not None:
+            self._quantized = np.concatenate([
+                self._quantized,
+                np.zeros((capacity - len(self._quantized), self._quantized.shape[1]), dtype=self._quantized.dtype),
+            ])
+        os.unlink(self._file(old_manifest["vectors"]))
+
+    def _tombstone(self, rows):
+        if not rows:
+            return
+        self._tombstone_writer.write("".join(f"{row}\n" for row in rows))
+        self._tombstone_writer.flush()
+        for row in rows:
+            self._alive[row] = False
+            if self._row_by_id.get(self._ids[row]) == row:
+                del self._row_by_id[self._ids[row]]
+            block_rows = self._rows_by_block_id.get(self._block_ids[row])
+            if block_rows is not None:
+                block_rows.discard(row)
+                if not block_rows:
+                    del self._rows_by_block_id[self._block_ids[row]]
+        self._dead += len(rows)
+
+    def add(self, points: List[Tuple]):
+        """Append (id, vector, payload) points, replacing earlier points with the same id"""
+        if not points:
+            return
+        vectors = np.asarray([vector for _, vector, _ in points], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        with self._lock:
+            start = self._count
+            if start + len(points) > len(self._vectors):
+                self._grow(start + len(points))
+            self._vectors[start:start + len(points)] = vectors
+            self._vectors.flush()
+            if self._quantized is not None:
+                if self.quantization == "int8" and self._int8_scale is None:
+                    self._int8_scale = self._fit_int8_scale(vectors)
+                self._quantized[start:start + len(points)] = self._quantize(vectors)
+
+            # Rows only exist once their point line is written, so a crash before this leaves no partial rows
+            lines = [(json.dumps({"id": point_id, "payload": payload}) + "\n").encode() for point_id, _, payload in points]
+            self._appender.write(b"".join(lines))
+            self._appender.flush()
+
+            replaced = []
+            for i, ((point_id, _, payload), line) in enumerate(zip(points, lines)):
+                row = start + i
+                if point_id in self._row_by_id:
+                    replaced.append(self._row_by_id[point_id])
+                self._ids.append(point_id)
+                self._block_ids.append(payload.get("block_id"))
+                self._offsets.append(self._points_size)
+                self._lengths.append(len(line))
+                self._points_size += len(line)
+                self._alive[row] = True
+                self._count += 1
+                self._index_row(row)
+            self._tombstone(replaced)
+            self._maybe_compact()
+
+    def delete_by_block_ids(self, block_ids: Iterable):
+        """Tombstone every point whose payload block_id is one of block_ids"""
+        with self._lock:
+            rows = set()
+            for block_id in block_ids:
+                rows.update(self._rows_by_block_id.get(block_id, ()))
+            self._tombstone(sorted(rows))
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self._count and self._dead / self._count > COMPACT_RATIO:
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the index without tombstoned rows"""
+        live = np.flatnonzero(self._alive[:self._count])
+        logger.debug(f"Compacting {self.path}: {len(live)} live of {self._count} rows")
+        old_manifest = self._manifest
+        vectors = self._new_files(max(INITIAL_CAPACITY, 2 * len(live)))
+        vectors[:len(live)] = self._vectors[live]
+        vectors.flush()
+        with open(self._file(self._manifest["points"]), "wb") as f:
+            for row in live:
+                f.write(self._reader.read(self._offsets[row], self._lengths[row]))
+        self._write_manifest()
+
+        self._appender.close()
+        self._tombstone_writer.close()
+        old_reader = self._reader
+        self._load()
+        self._remove_files(old_manifest)
+        # Searches that already read the old state hold their own references; the last one closes it
+        old_reader.release()
+
+    def __len__(self):
+        return self._count - self._dead
+
+    def search(self, query_vector: List[float], limit: int) -> List[SearchHit]:
+        """Cosine top-k over live rows: exact, or quantized scan plus float32 rescoring"""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            count = self._count
+            vectors, quantized = self._vectors, self._quantized
+            alive = self._alive[:count].copy()
+            ids, offsets, lengths, reader = self._ids, self._offsets, self._lengths, self._reader.acquire()
+        try:
+            return self._search(query, limit, count, vectors, quantized, alive, ids, offsets, lengths, reader)
+        finally:
+            reader.release()
+
+    def _search(self, query, limit, count, vectors, quantized, alive, ids, offsets, lengths, reader):
+        live_count = int(alive.sum())
+        limit = min(limit, live_count)
+        if limit <= 0:
+            return []
+        if quantized is None:
+            scores = vectors[:count] @ query
+            scores[~alive] = -np.inf
+            top = np.argpartition(-scores, limit - 1)[:limit]
+            top_scores = scores[top]
+        else:
+            approximate = self._approximate_scores(quantized, count, query)
+            approximate[~alive] = -np.inf
+            num_candidates = min(live_count, math.ceil(limit * self.rescore_oversampling))
+            candidates = np.sort(np.argpartition(-approximate, num_candidates - 1)[:num_candidates])
+            exact = vectors[candidates] @ query
+            best = np.argpartition(-exact, limit - 1)[:limit]
+            top, top_scores = candidates[best], exact[best]
+        order = np.argsort(-top_scores)
+        return [
+            SearchHit(
+                ids[row],
+                float(score),
+                json.loads(reader.read(offsets[row], lengths[row]))["payload"],
+            )
+            for row, score in zip(top[order], top_scores[order])
+        ]
+
+class NumpyBackend:
+    """
+    VectorStore backend keeping each collection in a NumpyIndex under `path`
+    No server or Qdrant install is needed, and an index opens as fast as its
+    id file can be read.
+    """
+    def __init__(
+        self,
+        path: str = "../../vector_index",
+        quantization: Optional[str] = None,
+        rescore_oversampling: float = RESCORE_OVERSAMPLING,
+    ):
+        logger.info(f"Using NumPy vector index at {path}")
+        self.path = path
+        self.quantization = quantization
+        self.rescore_oversampling = rescore_oversampling
+        self.indexes = {}
+
+    def create_collection(self, collection_name: str, vector_size: int):
+        if collection_name not in self.indexes:
+            self.indexes[collection_name] = NumpyIndex(
+                os.path.join(self.path, collection_name),
+                vector_size,
+                quantization=self.quantization,
+                rescore_oversampling=self.rescore_oversampling,
+            )
+
+    def upsert(self, collection_name: str, points: List[Tuple]):
+        self.indexes[collection_name].add(points)
+
+    def delete_by_block_ids(self, collection_name: str, block_ids: Iterable):
+        self.indexes[collection_name].delete_by_block_ids(block_ids)
+
+    def search(self, collection_name: str, query_vector: List[float], limit: int) -> List[SearchHit]:
+        return self.indexes[collection_name].search(query_vector, limit)
+
+    async def async_search(self, collection_name: str, query_vector: List[float], limit: int) -> List[SearchHit]:
+        # The matrix product releases the GIL, so this overlaps with other requests
+        return await asyncio.to_thread(self.search, collection_name, query_vector, limit)
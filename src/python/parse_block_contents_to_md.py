@@ -1,11 +1,33 @@
 from arena_utils import *
-from arena_utils import get_blocks_with_content_from_db
+from arena_utils import iter_blocks_from_db
 from arena_utils import get_existing_blocks_from_db
 from parse_utils import *
-from vector_store import VectorStore
-import sqlite3
+from arena_utils import save_block_chunks_to_db
+from chunk_utils import chunk_markdown
+from pipeline import IngestPipeline
+from vector_store import VectorStore, EMBED_BATCH_SIZE, UPSERT_BATCH_SIZE, EMBEDDING_CACHE_PATH
+import http_cache
+import http_client
+import pdf_pool
 import argparse
 
+def index_blocks(conn, vector_store, blocks_with_content):
+    """
+    Split blocks into passages, save them to SQLite and, unless vector_store
+    is None, upsert block-level and passage-level vectors
+    """
+    chunks_by_block_id = {
+        block_id: chunk_markdown(block["crawled_text"])
+        for block_id, block in blocks_with_content.items()
+        if block.get("crawled_text")
+    }
+    save_block_chunks_to_db(conn, chunks_by_block_id)
+    logger.info(f"Saved {sum(map(len, chunks_by_block_id.values()))} chunks for {len(chunks_by_block_id)} blocks")
+
+    if vector_store is not None:
+        vector_store.upsert_blocks(blocks_with_content)
+        vector_store.upsert_block_chunks(blocks_with_content, chunks_by_block_id)
+
 def main():
     # Setup argument parser
     parser = argparse.ArgumentParser(description='Parse Are.na blocks to markdown')
@@ -18,38 +40,89 @@ def main():
     parser.add_argument('--debug', 
                        action='store_true',
                        help='Enable debug logging')
+    parser.add_argument('--incremental',
+                       action='store_true',
+                       help='Only re-crawl and re-embed blocks changed on Are.na since the last incremental run')
     parser.add_argument('--transfer-vectors-only', action='store_true', help='Only read already parsed blocks from SQLite into vector storage')
+    parser.add_argument('--since',
+                       help='With --transfer-vectors-only, only blocks saved after this UTC timestamp (YYYY-MM-DD HH:MM:SS)')
     parser.add_argument('--skip-vectors', action='store_true', help='Skip vector storage')
     parser.add_argument('--qdrant-host', help='Remote Qdrant host')
     parser.add_argument('--qdrant-port', type=int, help='Remote Qdrant port')
+    parser.add_argument('--concurrency', type=int, default=8,
+                       help='Number of URLs fetched concurrently (default: 8, 1 for sequential)')
+    parser.add_argument('--per-host-concurrency', type=int, default=PER_HOST_CONCURRENCY,
+                       help=f'Number of URLs fetched concurrently per hostname (default: {PER_HOST_CONCURRENCY})')
+    parser.add_argument('--per-host-rate', type=float, default=PER_HOST_RATE,
+                       help=f'Maximum fetches started per second per hostname (default: {PER_HOST_RATE})')
+    parser.add_argument('--retry-failed', action='store_true',
+                       help='Fetch URLs that failed before even if crawl_status says to skip or wait')
+    parser.add_argument('--pdf-workers', type=int, default=pdf_pool.PDF_WORKERS,
+                       help=f'Number of processes parsing PDFs (default: {pdf_pool.PDF_WORKERS})')
+    parser.add_argument('--pdf-timeout', type=int, default=pdf_pool.PDF_TIMEOUT,
+                       help=f'Seconds a worker may spend parsing one PDF, or one shard of a long PDF (default: {pdf_pool.PDF_TIMEOUT})')
+    parser.add_argument('--max-download-mb', type=int, default=http_client.MAX_DOWNLOAD_BYTES // 1024 ** 2,
+                       help=f'Abandon pages and PDFs larger than this many MB (default: {http_client.MAX_DOWNLOAD_BYTES // 1024 ** 2})')
+    parser.add_argument('--offline', action='store_true',
+                       help='Serve page and PDF fetches only from the HTTP cache')
+    parser.add_argument('--no-http-cache', action='store_true',
+                       help='Fetch every page and PDF from the network without caching')
+    parser.add_argument('--http-cache-path', default=http_cache.HTTP_CACHE_PATH,
+                       help=f'Path of the HTTP response cache (default: {http_cache.HTTP_CACHE_PATH})')
+    parser.add_argument('--no-embedding-cache', action='store_true',
+                       help='Re-encode every text instead of reusing cached embeddings')
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE,
+                       help=f'Number of texts encoded per model forward pass (default: {EMBED_BATCH_SIZE})')
+    parser.add_argument('--upsert-batch-size', type=int, default=UPSERT_BATCH_SIZE,
+                       help=f'Number of points sent per Qdrant upsert request (default: {UPSERT_BATCH_SIZE})')
     args = parser.parse_args()
 
     if args.transfer_vectors_only and args.skip_vectors:
         logger.error("Cannot use --transfer-vectors-only with --skip-vectors")
         exit(1)
 
+    if args.offline and args.no_http_cache:
+        logger.error("Cannot use --offline with --no-http-cache")
+        exit(1)
+
+    if args.per_host_concurrency < 1:
+        logger.error("--per-host-concurrency must be at least 1")
+        exit(1)
+
     # Setup debug logging
     setup_logging(debug=args.debug)
+
+    # Size the shared HTTP connection pools for the crawl concurrency
+    http_client.configure_session(
+        pool_maxsize=max(http_client.POOL_MAXSIZE, args.concurrency),
+        max_download_bytes=args.max_download_mb * 1024 ** 2,
+    )
+    pdf_pool.configure_pdf_pool(max_workers=args.pdf_workers, timeout=args.pdf_timeout)
+    http_cache.configure_cache(
+        enabled=not args.no_http_cache,
+        path=args.http_cache_path,
+        offline=args.offline,
+    )
     
     # Initialize DB and vector store
-    conn = sqlite3.connect('../../store.sqlite3')
+    db_path = '../../store.sqlite3'
+    conn = connect_db(db_path)
     init_db(conn)
     
+    vector_store = None
     if not args.skip_vectors:
         vector_store = VectorStore(
             host=args.qdrant_host,
-            port=args.qdrant_port
+            port=args.qdrant_port,
+            embed_batch_size=args.embed_batch_size,
+            upsert_batch_size=args.upsert_batch_size,
+            embedding_cache_path=None if args.no_embedding_cache else EMBEDDING_CACHE_PATH,
         )
 
-    if not args.transfer_vectors_only:
-        # Get all blocks from DB
-        cur = conn.cursor()
-        cur.execute("SELECT id FROM block")
-        block_ids = [row[0] for row in cur.fetchall()]
-        
-        # Get full block data including parsed content
-        blocks_with_content = get_blocks_with_content_from_db(conn, block_ids)
-        vector_store.upsert_blocks(blocks_with_content)
+    if args.transfer_vectors_only:
+        # Page through parsed blocks so only one batch of text is in memory at a time
+        for blocks_with_content in iter_blocks_from_db(conn, since=args.since, content_only=True):
+            index_blocks(conn, vector_store, blocks_with_content)
         return
 
     # Get blocks from multiple channels
@@ -58,10 +131,34 @@ def main():
         "permaculture-gndkdg_ckpc",
         "african-empires-states",
     ]
-    blocks = []
-    for channel_slug in channel_slugs:
-        channel_blocks = get_channel_blocks_paginated(channel_slug)
-        blocks.extend(channel_blocks)
+    blocks_by_channel = {channel_slug: [] for channel_slug in channel_slugs}
+    # Channels whose blocks could not all be fetched keep their cursor
+    failed_channels = set()
+    if args.incremental:
+        for channel_slug in channel_slugs:
+            since = get_sync_cursor(conn, channel_slug, sync_name="content")
+            try:
+                blocks_by_channel[channel_slug] = get_channel_blocks_since(channel_slug, since=since)
+            except Exception as e:
+                logger.error(f"Failed to fetch changes of {channel_slug}, leaving its cursor alone: {e}")
+                failed_channels.add(channel_slug)
+                continue
+            logger.info(f"{channel_slug}: {len(blocks_by_channel[channel_slug])} blocks changed since {since}")
+    else:
+        try:
+            for channel_slug, block in iter_channels_blocks(channel_slugs):
+                blocks_by_channel[channel_slug].append(block)
+        except ChannelPagesError as e:
+            logger.error(f"{e}, leaving the cursors of those channels alone")
+            failed_channels.update(e.failed_pages)
+    blocks = [block for channel_blocks in blocks_by_channel.values() for block in channel_blocks]
+
+    if args.incremental:
+        # Blocks whose crawl failed are unchanged on Are.na, so the cursor query never returns them again
+        seen_block_ids = {block["id"] for block in blocks}
+        recrawl_blocks = [block for block in get_blocks_to_recrawl(conn) if block["id"] not in seen_block_ids]
+        logger.info(f"{len(recrawl_blocks)} saved blocks without content are due a crawl")
+        blocks.extend(recrawl_blocks)
 
     # Filter blocks based on pdf_only flag
     if args.pdf_only:
@@ -87,30 +184,45 @@ def main():
     # Check which blocks already exist in DB
     existing_blocks = get_existing_blocks_from_db(conn, list(blocks_by_id.keys()))
 
-    # Filter to blocks that need parsing
-    blocks_to_parse = [
-        block for block in blocks_to_parse 
-        if block["id"] not in existing_blocks 
-        or existing_blocks[block["id"]]["crawled_text"] is None
-    ]
+    if args.incremental:
+        # Save and re-embed blocks that are new or changed on Are.na, re-crawling
+        # those never crawled or whose source URL moved
+        changed_block_ids = set(get_changed_block_ids(conn, blocks_by_id))
+        blocks_to_parse = [
+            block for block in blocks_to_parse
+            if block["id"] not in existing_blocks
+            or not existing_blocks[block["id"]]["has_content"]
+            or existing_blocks[block["id"]]["source_url"] != (block.get("source") or {}).get("url")
+        ]
+        changed_block_ids.update(block["id"] for block in blocks_to_parse)
+        blocks_by_id = {block_id: block for block_id, block in blocks_by_id.items() if block_id in changed_block_ids}
+    else:
+        # Filter to blocks that need parsing
+        blocks_to_parse = [
+            block for block in blocks_to_parse 
+            if block["id"] not in existing_blocks 
+            or not existing_blocks[block["id"]]["has_content"]
+        ]
 
     logger.info(f"Found {len(blocks_to_parse)} blocks to parse")
 
-    # Parse content (passing pdf_only flag)
-    parsed_content = parse_block_contents(blocks_to_parse, pdf_only=args.pdf_only)
-
-    # Save to DB
-    save_block_to_db(conn, 
-        block_ids=list(blocks_by_id.keys()),
-        block_data_by_id=blocks_by_id,
-        parsed_block_content_by_url=parsed_content
+    # Fetch, parse, save and embed as a stream, committing small batches as documents arrive
+    pipeline = IngestPipeline(
+        db_path,
+        vector_store=vector_store,
+        pdf_only=args.pdf_only,
+        concurrency=args.concurrency,
+        per_host_concurrency=args.per_host_concurrency,
+        per_host_rate=args.per_host_rate,
+        retry_failed=args.retry_failed,
     )
+    pipeline.run(blocks_by_id, blocks_to_parse)
 
-    # Save to vector store
-    if not args.skip_vectors:
-        # Get full block data including parsed content
-        blocks_with_content = get_blocks_with_content_from_db(conn, list(blocks_by_id.keys()))
-        vector_store.upsert_blocks(blocks_with_content)
+    # Advance the crawl cursors, unless a content filter skipped some changed blocks
+    if not args.pdf_only and not args.wikipedia_only:
+        for channel_slug, channel_blocks in blocks_by_channel.items():
+            if channel_slug not in failed_channels:
+                save_sync_cursor(conn, channel_slug, channel_blocks, sync_name="content")
 
     conn.close()
 
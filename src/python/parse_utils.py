@@ -1,15 +1,35 @@
+import http_cache
+import http_client
 import requests
 from bs4 import BeautifulSoup
 from markdownify import markdownify as md
 import re
 import logging
-import tempfile
-import os
-import pymupdf4llm
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+import pdf_pool
 
 # Setup logging
 logger = logging.getLogger(__name__)
 
+# Crawl politeness defaults: simultaneous requests and requests/second per hostname
+PER_HOST_CONCURRENCY = 2
+PER_HOST_RATE = 2.0
+
+# Fetch failures that will not go away on retry
+PERMANENT_HTTP_STATUSES = (400, 404, 405, 410, 414, 451)
+PERMANENT_ERRORS = (
+    requests.exceptions.InvalidURL,
+    requests.exceptions.MissingSchema,
+    requests.exceptions.InvalidSchema,
+    http_client.ResponseTooLarge,
+)
+
+class EmptyContent(Exception):
+    """Raised when a fetched page yields no content"""
+
 def setup_logging(debug=False):
     """Configure logging level and format"""
     level = logging.DEBUG if debug else logging.INFO
@@ -95,48 +115,77 @@ def clean_markdown(markdown_text):
     logger.debug(f"Markdown cleanup complete. Length reduced from {original_length} to {len(cleaned_text)} chars")
     return cleaned_text
 
-def fetch_and_parse_pdf(url):
-    """
-    Fetch and parse PDF content to markdown
-    Returns None if failed
-    """
-    logger.debug(f"Fetching PDF from URL: {url}")
-    try:
-        # Fetch PDF
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        # Save PDF to temporary file
-        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-            tmp_file.write(response.content)
-            tmp_path = tmp_file.name
-        
-        logger.debug(f"Saved PDF to temporary file: {tmp_path}")
-        
-        try:
-            # Parse PDF using MuPDF
-            markdown_content = pymupdf4llm.to_markdown(tmp_path)
-            
-            # Clean up the markdown content
-            cleaned_markdown = clean_markdown(markdown_content)
-            
-            logger.debug(f"Successfully parsed PDF. Content length: {len(cleaned_markdown)}")
-            return cleaned_markdown
-            
-        finally:
-            # Clean up temporary file
-            os.unlink(tmp_path)
-            logger.debug("Removed temporary PDF file")
-            
-    except Exception as e:
-        logger.error(f"Error parsing PDF from {url}: {str(e)}", exc_info=True)
-        return None
+def parse_pdf_bytes(pdf_bytes):
+    """Parse an in-memory PDF to cleaned markdown in the PDF process pool"""
+    markdown_content = pdf_pool.parse_pdf(pdf_bytes)
+    cleaned_markdown = clean_markdown(markdown_content)
+    logger.debug(f"Successfully parsed PDF. Content length: {len(cleaned_markdown)}")
+    return cleaned_markdown
 
 def is_pdf_url(url, content_type=None):
     """Check if URL points to a PDF"""
     return (url.lower().endswith('.pdf') or 
             (content_type and 'application/pdf' in content_type.lower()))
 
+def _fetch_and_parse_url(url, pdf_only=False):
+    """Fetch and parse a URL, raising on failure; None means skipped by pdf_only"""
+    logger.debug(f"Fetching and parsing URL: {url} (PDF only: {pdf_only})")
+    # Handle web pages, and PDFs by extension or content type
+    response = http_cache.get(url)
+    response.raise_for_status()
+    logger.debug(f"Successfully fetched URL. Content length: {len(response.content)}")
+
+    content_type = response.headers.get('content-type', '').lower()
+    if url.lower().endswith('.pdf') or 'application/pdf' in content_type:
+        logger.debug("Processing as PDF document")
+        cleaned_markdown = parse_pdf_bytes(response.content)
+        if not cleaned_markdown:
+            raise EmptyContent(f"No text extracted from PDF {url}")
+        return cleaned_markdown
+
+    # If pdf_only is True, skip non-PDF content
+    if pdf_only:
+        logger.debug("Skipping non-PDF content")
+        return None
+
+    # Handle Wikipedia pages
+    if 'wikipedia.org' in url:
+        logger.debug("Processing as Wikipedia page")
+        cleaned_html = clean_wikipedia_content(response.text)
+    else:
+        logger.debug("Processing as generic webpage")
+        cleaned_html = response.text
+
+    if not cleaned_html:
+        raise EmptyContent(f"No content extracted from {url}")
+
+    # Convert to markdown
+    markdown_content = html_to_markdown(cleaned_html)
+
+    # Clean up markdown
+    cleaned_markdown = clean_markdown(markdown_content)
+    if not cleaned_markdown:
+        raise EmptyContent(f"No content extracted from {url}")
+
+    logger.debug(f"Successfully parsed URL. Final content length: {len(cleaned_markdown)}")
+    return cleaned_markdown
+
+def fetch_url_with_status(url, pdf_only=False):
+    """
+    Fetch URL content and parse it to markdown, keeping the failure
+    Returns:
+        (parsed markdown or None, exception or None) tuple; both are None
+        when pdf_only skipped a non-PDF page
+    """
+    try:
+        return _fetch_and_parse_url(url, pdf_only=pdf_only), None
+    except EmptyContent as e:
+        logger.warning(str(e))
+        return None, e
+    except Exception as e:
+        logger.error(f"Error fetching/parsing {url}: {str(e)}", exc_info=not isinstance(e, requests.RequestException))
+        return None, e
+
 def fetch_and_parse_url(url, pdf_only=False):
     """
     Fetch URL content and parse it to markdown
@@ -146,88 +195,146 @@ def fetch_and_parse_url(url, pdf_only=False):
     Returns:
         Parsed markdown content or None if failed
     """
-    logger.debug(f"Fetching and parsing URL: {url} (PDF only: {pdf_only})")
-    try:
-        # Check if URL is PDF
-        if url.lower().endswith('.pdf'):
-            logger.debug("Processing as PDF document")
-            return fetch_and_parse_pdf(url)
-            
-        # Handle web pages
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        logger.debug(f"Successfully fetched URL. Content length: {len(response.text)}")
-        
-        # Check content type for PDF
-        content_type = response.headers.get('content-type', '').lower()
-        if 'application/pdf' in content_type:
-            logger.debug("Content-type indicates PDF, processing as PDF document")
-            return fetch_and_parse_pdf(url)
-            
-        # If pdf_only is True, skip non-PDF content
-        if pdf_only:
-            logger.debug("Skipping non-PDF content")
-            return None
-        
-        # Handle Wikipedia pages
-        if 'wikipedia.org' in url:
-            logger.debug("Processing as Wikipedia page")
-            cleaned_html = clean_wikipedia_content(response.text)
-        else:
-            logger.debug("Processing as generic webpage")
-            cleaned_html = response.text
-            
-        if not cleaned_html:
-            logger.warning(f"No content extracted from {url}")
-            return None
-            
-        # Convert to markdown
-        markdown_content = html_to_markdown(cleaned_html)
-        
-        # Clean up markdown
-        cleaned_markdown = clean_markdown(markdown_content)
-        
-        logger.debug(f"Successfully parsed URL. Final content length: {len(cleaned_markdown)}")
-        return cleaned_markdown
-        
-    except Exception as e:
-        logger.error(f"Error fetching/parsing {url}: {str(e)}", exc_info=True)
-        return None
+    return fetch_url_with_status(url, pdf_only=pdf_only)[0]
 
-def parse_block_contents(blocks, pdf_only=False):
+def classify_fetch_error(error):
     """
-    Parse content for a list of blocks
-    Args:
-        blocks: List of blocks to parse
-        pdf_only: If True, only process PDF files
+    Describe a fetch failure for crawl_status
     Returns:
-        Dictionary of url -> parsed content
+        (error class name, HTTP status or None, whether retrying is pointless) tuple
     """
-    logger.info(f"Starting to parse {len(blocks)} blocks (PDF only: {pdf_only})")
-    parsed_content = {}
-    
+    response = getattr(error, "response", None)
+    http_status = response.status_code if response is not None else None
+    permanent = isinstance(error, PERMANENT_ERRORS) or http_status in PERMANENT_HTTP_STATUSES
+    return type(error).__name__, http_status, permanent
+
+def iter_urls_to_parse(blocks, pdf_only=False):
+    """Yield the unique source URLs of blocks that should be fetched"""
+    seen = set()
     for i, block in enumerate(blocks, 1):
-        logger.debug(f"Processing block {i}/{len(blocks)}")
         if not block.get("source") or not block["source"].get("url"):
             logger.debug(f"Skipping block {i} - no source URL")
             continue
-            
+
         url = block["source"]["url"]
         content_type = block["source"].get("content_type", "")
-        
+
         # Skip non-PDF files if pdf_only is True
         if pdf_only and not is_pdf_url(url, content_type):
             logger.debug(f"Skipping non-PDF URL: {url}")
             continue
-            
-        if url not in parsed_content:
-            logger.debug(f"Parsing new URL: {url}")
-            content = fetch_and_parse_url(url, pdf_only=pdf_only)
-            if content:
-                parsed_content[url] = content
-                logger.debug(f"Successfully parsed content for {url}")
-            else:
-                logger.warning(f"Failed to parse content for {url}")
+
+        if url not in seen:
+            seen.add(url)
+            yield url
+
+def iter_block_contents(
+    blocks,
+    pdf_only=False,
+    concurrency=1,
+    per_host_concurrency=PER_HOST_CONCURRENCY,
+    per_host_rate=PER_HOST_RATE,
+):
+    """
+    Fetch and parse the source URLs of blocks concurrently
+    URLs are dispatched to a thread pool of `concurrency` workers, never
+    running more than `per_host_concurrency` requests against one hostname
+    or starting them faster than `per_host_rate` per second, so a channel
+    full of Wikipedia links cannot starve other hosts or hammer Wikipedia.
+    Args:
+        blocks: List of blocks to parse
+        pdf_only: If True, only process PDF files
+        concurrency: Maximum number of requests in flight overall
+        per_host_concurrency: Maximum number of requests in flight per hostname
+        per_host_rate: Maximum requests started per second per hostname (0 for no limit)
+    Yields:
+        (url, parsed content or None, exception or None) tuples, in completion order
+    """
+    if per_host_concurrency < 1:
+        # Nothing could ever be dispatched, and the loop below would spin forever
+        raise ValueError(f"per_host_concurrency must be at least 1, got {per_host_concurrency}")
+    pending_by_host = {}
+    for url in iter_urls_to_parse(blocks, pdf_only=pdf_only):
+        pending_by_host.setdefault(urlparse(url).netloc, deque()).append(url)
+
+    total = sum(len(urls) for urls in pending_by_host.values())
+    logger.info(f"Fetching {total} URLs across {len(pending_by_host)} hosts (concurrency: {concurrency})")
+
+    min_interval = 1.0 / per_host_rate if per_host_rate else 0.0
+    in_flight_by_host = {}
+    next_start_by_host = {}
+    futures = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        while pending_by_host or futures:
+            # Dispatch round-robin across hosts that have a free slot and are past their rate limit
+            now = time.monotonic()
+            for host in list(pending_by_host):
+                if len(futures) >= max(1, concurrency):
+                    break
+                if in_flight_by_host.get(host, 0) >= per_host_concurrency:
+                    continue
+                if next_start_by_host.get(host, 0.0) > now:
+                    continue
+                url = pending_by_host[host].popleft()
+                if not pending_by_host[host]:
+                    del pending_by_host[host]
+                in_flight_by_host[host] = in_flight_by_host.get(host, 0) + 1
+                next_start_by_host[host] = now + min_interval
+                futures[executor.submit(fetch_url_with_status, url, pdf_only)] = (host, url)
+
+            # Wake up when a fetch completes or the next rate-limited host becomes eligible
+            timeout = None
+            waiting = [
+                next_start_by_host[host] - now for host in pending_by_host
+                if host in next_start_by_host
+                and in_flight_by_host.get(host, 0) < per_host_concurrency
+            ]
+            if waiting and len(futures) < max(1, concurrency):
+                timeout = max(0.0, min(waiting))
+            if not futures:
+                time.sleep(timeout or 0.0)
+                continue
+
+            done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                host, url = futures.pop(future)
+                in_flight_by_host[host] -= 1
+                yield (url, *future.result())
+
+def parse_block_contents(
+    blocks,
+    pdf_only=False,
+    concurrency=1,
+    per_host_concurrency=PER_HOST_CONCURRENCY,
+    per_host_rate=PER_HOST_RATE,
+):
+    """
+    Parse content for a list of blocks
+    Args:
+        blocks: List of blocks to parse
+        pdf_only: If True, only process PDF files
+        concurrency: Maximum number of URLs fetched at once
+        per_host_concurrency: Maximum number of URLs fetched at once per hostname
+        per_host_rate: Maximum fetches started per second per hostname
+    Returns:
+        Dictionary of url -> parsed content
+    """
+    logger.info(f"Starting to parse {len(blocks)} blocks (PDF only: {pdf_only})")
+    parsed_content = {}
+
+    for url, content, _ in iter_block_contents(
+        blocks,
+        pdf_only=pdf_only,
+        concurrency=concurrency,
+        per_host_concurrency=per_host_concurrency,
+        per_host_rate=per_host_rate,
+    ):
+        if content:
+            parsed_content[url] = content
+            logger.debug(f"Successfully parsed content for {url}")
+        else:
+            logger.warning(f"Failed to parse content for {url}")
     
     logger.info(f"Completed parsing {len(parsed_content)} unique URLs")
-    return parsed_content
\ No newline at end of file
+    return parsed_content
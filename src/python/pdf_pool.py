@@ -0,0 +1,214 @@
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+import pymupdf4llm
+
+logger = logging.getLogger(__name__)
+
+PDF_WORKERS = os.cpu_count() or 1
+PAGES_PER_SHARD = 20     # PDFs longer than this are split into page ranges parsed in parallel
+PDF_TIMEOUT = 300        # seconds a worker may spend on one document or shard before it is killed
+
+class PDFTimeout(Exception):
+    """Raised when a PDF takes longer than the timeout to parse"""
+
+class PDFWorkerCrashed(Exception):
+    """Raised when the worker parsing a PDF died, e.g. from a PyMuPDF segfault or an OOM kill"""
+
+_pool = None
+_pool_lock = threading.Lock()
+_max_workers = PDF_WORKERS
+_pages_per_shard = PAGES_PER_SHARD
+_timeout = PDF_TIMEOUT
+
+def _extract_markdown(source, pages=None, max_pages=None):
+    """
+    Worker: convert a PDF (bytes or file path) to markdown
+    If pages is None and the document is longer than max_pages, only the page
+    count is returned so the caller can shard it.
+    Returns:
+        (page_count, markdown or None)
+    """
+    if isinstance(source, bytes):
+        doc = pymupdf.open(stream=source, filetype="pdf")
+    else:
+        doc = pymupdf.open(source)
+    with doc:
+        if pages is None and max_pages and doc.page_count > max_pages:
+            return doc.page_count, None
+        return doc.page_count, pymupdf4llm.to_markdown(doc, pages=pages, show_progress=False)
+
+def _worker_main(conn):
+    """Worker process: run the _extract_markdown calls received on conn until it closes"""
+    while True:
+        try:
+            args = conn.recv()
+        except EOFError:
+            return
+        try:
+            result = (True, _extract_markdown(*args))
+        except Exception as e:
+            result = (False, e)
+        try:
+            conn.send(result)
+        except Exception:
+            # The exception could not be pickled
+            conn.send((False, RuntimeError(f"{type(result[1]).__name__}: {result[1]}")))
+
+class _Worker:
+    """One parsing process and the pipe to it"""
+    def __init__(self):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class PDFPool:
+    """
+    Processes parsing PDFs one task at a time
+    A task's timeout starts when a worker picks it up, not while it waits
+    behind other documents, and a task that times out or crashes costs only
+    the worker running it.
+    """
+    def __init__(self, max_workers=PDF_WORKERS):
+        self.max_workers = max_workers
+        self._idle = []
+        self._num_workers = 0
+        self._closed = False
+        self._available = threading.Condition()
+
+    def _acquire(self):
+        with self._available:
+            while not self._idle and self._num_workers >= self.max_workers:
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._num_workers += 1
+        try:
+            return _Worker()
+        except Exception:
+            self._discard(None)
+            raise
+
+    def _release(self, worker):
+        with self._available:
+            if not self._closed:
+                self._idle.append(worker)
+                self._available.notify()
+                return
+        self._discard(worker)
+
+    def _discard(self, worker):
+        if worker is not None:
+            worker.kill()
+        with self._available:
+            self._num_workers -= 1
+            self._available.notify()
+
+    def run(self, args, timeout):
+        """Run _extract_markdown(*args) in a worker, killing the worker if it takes longer than timeout seconds"""
+        worker = self._acquire()
+        try:
+            worker.conn.send(args)
+            if not worker.conn.poll(timeout):
+                self._discard(worker)
+                raise PDFTimeout(f"PDF parsing exceeded {timeout}s")
+            ok, result = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._discard(worker)
+            raise PDFWorkerCrashed(f"PDF worker exited with code {worker.process.exitcode}") from e
+        self._release(worker)
+        if not ok:
+            raise result
+        return result
+
+    def close(self):
+        """Kill the idle workers; busy ones are killed when their task finishes"""
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for worker in idle:
+            self._discard(worker)
+
+def configure_pdf_pool(max_workers=PDF_WORKERS, pages_per_shard=PAGES_PER_SHARD, timeout=PDF_TIMEOUT):
+    """Set worker count, shard size and timeout, replacing the pool"""
+    global _pool, _max_workers, _pages_per_shard, _timeout
+    with _pool_lock:
+        _max_workers = max_workers
+        _pages_per_shard = pages_per_shard
+        _timeout = timeout
+        old_pool, _pool = _pool, None
+    if old_pool is not None:
+        old_pool.close()
+
+def get_pdf_pool():
+    """Get the shared worker pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = PDFPool(max_workers=_max_workers)
+        return _pool
+
+def _shard_pages(page_count, pages_per_shard):
+    return [
+        list(range(start, min(start + pages_per_shard, page_count)))
+        for start in range(0, page_count, pages_per_shard)
+    ]
+
+def _parse(source, timeout):
+    pool = get_pdf_pool()
+    page_count, markdown = pool.run((source, None, _pages_per_shard), timeout)
+    if markdown is not None:
+        return markdown
+
+    # Large document: spill to disk once so shards don't each receive a copy of the bytes
+    tmp_path = None
+    if isinstance(source, bytes):
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
+            tmp_file.write(source)
+            tmp_path = source = tmp_file.name
+    try:
+        shards = _shard_pages(page_count, _pages_per_shard)
+        logger.debug(f"Parsing {page_count} page PDF in {len(shards)} shards")
+        with ThreadPoolExecutor(max_workers=min(len(shards), pool.max_workers)) as executor:
+            futures = [executor.submit(pool.run, (source, pages), timeout) for pages in shards]
+            try:
+                return "".join(future.result()[1] for future in futures)
+            except Exception:
+                # Don't start the remaining shards of a document that already failed
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+def parse_pdf(source, timeout=None):
+    """
+    Convert a PDF to markdown in the shared worker pool
+    Documents longer than the shard size are split into page ranges parsed in
+    parallel and reassembled in page order. A document or shard that runs
+    longer than the timeout has its worker killed and raises PDFTimeout.
+    Args:
+        source: PDF bytes or path to a PDF file
+        timeout: Seconds allowed per document or shard (default: configured timeout)
+    Returns:
+        Raw markdown of the document
+    """
+    timeout = timeout or _timeout
+    try:
+        return _parse(source, timeout)
+    except PDFWorkerCrashed as e:
+        # An OOM kill may not recur once other documents are done; retry once on a fresh worker
+        logger.warning(f"{e}, retrying once")
+        return _parse(source, timeout)
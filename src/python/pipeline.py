@@ -0,0 +1,233 @@
+import logging
+import queue
+import threading
+import time
+
+import http_cache
+from arena_utils import (
+    connect_db,
+    get_blocks_with_content_from_db,
+    get_urls_not_due,
+    save_block_chunks_to_db,
+    save_block_to_db,
+    save_crawl_results,
+)
+from chunk_utils import chunk_markdown
+from parse_utils import PER_HOST_CONCURRENCY, PER_HOST_RATE, classify_fetch_error, iter_block_contents, iter_urls_to_parse
+
+logger = logging.getLogger(__name__)
+
+FETCH_QUEUE_SIZE = 32       # parsed documents waiting to be saved before fetching pauses
+EMBED_QUEUE_SIZE = 4        # saved batches waiting to be embedded before saving pauses
+SAVE_BATCH_SIZE = 16        # blocks committed to SQLite per transaction
+EMBED_ROUND_SIZE = 64       # blocks embedded and upserted per round
+FLUSH_INTERVAL = 5.0        # seconds a partial batch waits for more items when upstream is slow
+
+_DONE = object()
+
+class _Stopped(Exception):
+    """Raised in a stage when another stage failed"""
+
+class IngestPipeline:
+    """
+    Streaming crawl pipeline: fetch/parse -> save -> embed
+    Each stage runs on its own thread, connected by bounded queues. A full
+    queue blocks the stage feeding it, so a slow save or embed stage
+    throttles fetching instead of piling parsed documents up in memory.
+    Blocks are committed to SQLite in batches of save_batch_size as their
+    documents arrive, so a crash loses at most the batches in flight.
+    Every fetch outcome is recorded in crawl_status in the same batches;
+    URLs that failed permanently or are waiting out a retry backoff are not
+    fetched unless retry_failed is set.
+    """
+    def __init__(
+        self,
+        db_path,
+        vector_store=None,
+        pdf_only=False,
+        concurrency=1,
+        per_host_concurrency=PER_HOST_CONCURRENCY,
+        per_host_rate=PER_HOST_RATE,
+        save_batch_size=SAVE_BATCH_SIZE,
+        embed_round_size=EMBED_ROUND_SIZE,
+        retry_failed=False,
+    ):
+        self.db_path = db_path
+        self.vector_store = vector_store
+        self.pdf_only = pdf_only
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.per_host_rate = per_host_rate
+        self.save_batch_size = save_batch_size
+        self.embed_round_size = embed_round_size
+        self.retry_failed = retry_failed
+        self.stats = {"parsed": 0, "failed": 0, "skipped": 0, "saved": 0, "embedded": 0}
+        self._stop = threading.Event()
+        self._errors = []
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise _Stopped()
+
+    def _get(self, q, timeout):
+        """Get an item, or None if nothing arrived within timeout"""
+        deadline = time.monotonic() + timeout
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=max(0.0, min(0.5, deadline - time.monotonic())))
+            except queue.Empty:
+                if time.monotonic() >= deadline:
+                    return None
+        raise _Stopped()
+
+    def _fetch(self, blocks_by_id, blocks_to_parse, saves):
+        """
+        Emit (block_ids, {url: content}, crawl results) items: first blocks
+        that need no fetch, then each fetched URL
+        """
+        block_ids_by_url = {}
+        for block_id, block in blocks_by_id.items():
+            url = (block.get("source") or {}).get("url")
+            if url:
+                block_ids_by_url.setdefault(url, []).append(block_id)
+        urls_to_parse = set(iter_urls_to_parse(blocks_to_parse, pdf_only=self.pdf_only))
+
+        if not self.retry_failed:
+            conn = connect_db(self.db_path)
+            try:
+                not_due = get_urls_not_due(conn, urls_to_parse)
+            finally:
+                conn.close()
+            if not_due:
+                logger.info(f"Skipping {len(not_due)} URLs that failed before (use --retry-failed to fetch them anyway)")
+            self.stats["skipped"] = len(not_due)
+            urls_to_parse -= not_due.keys()
+            blocks_to_parse = [block for block in blocks_to_parse if (block.get("source") or {}).get("url") not in not_due]
+
+        for url, block_ids in block_ids_by_url.items():
+            if url not in urls_to_parse:
+                self._put(saves, (block_ids, {}, []))
+
+        for url, content, error in iter_block_contents(
+            blocks_to_parse,
+            pdf_only=self.pdf_only,
+            concurrency=self.concurrency,
+            per_host_concurrency=self.per_host_concurrency,
+            per_host_rate=self.per_host_rate,
+        ):
+            if content:
+                self.stats["parsed"] += 1
+                crawl_results = [(url, None)]
+            elif error is not None and not isinstance(error, http_cache.OfflineCacheMiss):
+                self.stats["failed"] += 1
+                error_class, http_status, permanent = classify_fetch_error(error)
+                crawl_results = [(url, (error_class, str(error), http_status, permanent))]
+            else:
+                # Skipped by pdf_only, or not cached while offline: nothing learned about the URL
+                crawl_results = []
+            self._put(saves, (block_ids_by_url.get(url, []), {url: content} if content else {}, crawl_results))
+        self._put(saves, _DONE)
+
+    def _save(self, blocks_by_id, saves, embeds):
+        conn = connect_db(self.db_path)
+        try:
+            done = False
+            while not done:
+                block_ids, parsed_content, crawl_results = [], {}, []
+                deadline = time.monotonic() + FLUSH_INTERVAL
+                while len(block_ids) < self.save_batch_size:
+                    item = self._get(saves, deadline - time.monotonic())
+                    if item is None:
+                        break
+                    if item is _DONE:
+                        done = True
+                        break
+                    block_ids.extend(item[0])
+                    parsed_content.update(item[1])
+                    crawl_results.extend(item[2])
+                save_crawl_results(conn, crawl_results)
+                if not block_ids:
+                    continue
+
+                save_block_to_db(conn, block_ids=block_ids, block_data_by_id=blocks_by_id, parsed_block_content_by_url=parsed_content)
+                blocks_with_content = get_blocks_with_content_from_db(conn, block_ids)
+                chunks_by_block_id = {
+                    block_id: chunk_markdown(block["crawled_text"])
+                    for block_id, block in blocks_with_content.items()
+                    if block.get("crawled_text")
+                }
+                save_block_chunks_to_db(conn, chunks_by_block_id)
+                self.stats["saved"] += len(block_ids)
+                logger.info(f"Saved {self.stats['saved']}/{len(blocks_by_id)} blocks ({self.stats['parsed']} parsed, {self.stats['failed']} failed)")
+                if self.vector_store is not None:
+                    self._put(embeds, (blocks_with_content, chunks_by_block_id))
+        finally:
+            conn.close()
+        self._put(embeds, _DONE)
+
+    def _embed(self, embeds):
+        done = False
+        while not done:
+            blocks_with_content, chunks_by_block_id = {}, {}
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            while len(blocks_with_content) < self.embed_round_size:
+                item = self._get(embeds, deadline - time.monotonic())
+                if item is None:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                blocks_with_content.update(item[0])
+                chunks_by_block_id.update(item[1])
+            if not blocks_with_content:
+                continue
+            self.vector_store.upsert_blocks(blocks_with_content)
+            self.vector_store.upsert_block_chunks(blocks_with_content, chunks_by_block_id)
+            self.stats["embedded"] += len(blocks_with_content)
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except _Stopped:
+            pass
+        except Exception as e:
+            logger.error(f"Pipeline stage {target.__name__} failed: {e}", exc_info=True)
+            self._errors.append(e)
+            self._stop.set()
+
+    def run(self, blocks_by_id, blocks_to_parse):
+        """
+        Save every block in blocks_by_id, with fresh content for blocks_to_parse,
+        and embed them if a vector store was given
+        Args:
+            blocks_by_id: Dict of block_id -> Are.na block to save
+            blocks_to_parse: Blocks (a subset of blocks_by_id) whose source URL to fetch
+        Returns:
+            Dict of parsed, failed, saved and embedded counts
+        """
+        saves = queue.Queue(maxsize=FETCH_QUEUE_SIZE)
+        embeds = queue.Queue(maxsize=EMBED_QUEUE_SIZE)
+        stages = [
+            threading.Thread(target=self._run_stage, args=(self._fetch, blocks_by_id, blocks_to_parse, saves), name="pipeline-fetch"),
+            threading.Thread(target=self._run_stage, args=(self._save, blocks_by_id, saves, embeds), name="pipeline-save"),
+        ]
+        if self.vector_store is not None:
+            stages.append(threading.Thread(target=self._run_stage, args=(self._embed, embeds), name="pipeline-embed"))
+        for stage in stages:
+            stage.start()
+        try:
+            for stage in stages:
+                stage.join()
+        except BaseException:
+            # e.g. Ctrl-C: let the stages finish their current batch and exit
+            self._stop.set()
+            raise
+        if self._errors:
+            raise self._errors[0]
+        logger.info(f"Pipeline finished: {self.stats}")
+        return self.stats
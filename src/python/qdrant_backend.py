@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
+from qdrant_client.http.models import Distance, VectorParams
+
+from numpy_index import INT8_QUANTILE
+
+logger = logging.getLogger(__name__)
+
+RESCORE_OVERSAMPLING = 3.0
+
+def _quantization_config(quantization: Optional[str]):
+    if quantization is None:
+        return None
+    if quantization == "int8":
+        return models.ScalarQuantization(scalar=models.ScalarQuantizationConfig(
+            type=models.ScalarType.INT8, quantile=INT8_QUANTILE, always_ram=True,
+        ))
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    raise ValueError(f"Unknown quantization: {quantization}")
+
+class QdrantBackend:
+    """
+    VectorStore backend storing points in Qdrant, either a server or local
+    path storage
+    Points are (id, vector, payload) tuples; search hits have .id, .score
+    and .payload.
+
+    With quantization "int8" or "binary", collections keep quantized vectors
+    in RAM and the float32 originals and payloads on disk; searches
+    oversample on the quantized vectors and rescore with the originals.
+    Local path storage accepts the settings but always searches exactly.
+    """
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        path: str = "../../qdrant_data",
+        quantization: Optional[str] = None,
+        rescore_oversampling: float = RESCORE_OVERSAMPLING,
+    ):
+        self.quantization_config = _quantization_config(quantization)
+        self.search_params = None
+        if quantization is not None:
+            self.search_params = models.SearchParams(quantization=models.QuantizationSearchParams(
+                rescore=True, oversampling=rescore_oversampling,
+            ))
+        if host:
+            logger.info(f"Connecting to Qdrant at {host}:{port}")
+            api_key = os.getenv('QDRANT_API_KEY')
+            self.client = QdrantClient(host=host, port=port, api_key=api_key)
+            self.async_client = AsyncQdrantClient(host=host, port=port, api_key=api_key)
+        else:
+            logger.info(f"Using local Qdrant storage at {path}")
+            self.client = QdrantClient(path=path)
+            # Local storage is locked to one client, so async searches use the sync client in a thread
+            self.async_client = None
+
+    def create_collection(self, collection_name: str, vector_size: int):
+        """Create Qdrant collection if it doesn't exist"""
+        collections = self.client.get_collections().collections
+        exists = any(c.name == collection_name for c in collections)
+
+        quantized = self.quantization_config is not None
+        if not exists:
+            logger.info(f"Creating collection: {collection_name}")
+            self.client.create_collection(
+                collection_name=collection_name,
+                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE, on_disk=quantized),
+                quantization_config=self.quantization_config,
+                on_disk_payload=quantized,
+            )
+        elif quantized and self.async_client is not None:
+            config = self.client.get_collection(collection_name).config
+            if (
+                config.quantization_config != self.quantization_config
+                or not config.params.vectors.on_disk
+                or not config.params.on_disk_payload
+            ):
+                # Quantize an existing server collection in place and move its float32
+                # vectors and payloads to disk; Qdrant rebuilds its segments in the background
+                logger.info(f"Enabling quantization and on-disk storage on collection: {collection_name}")
+                self.client.update_collection(
+                    collection_name=collection_name,
+                    vectors_config={"": models.VectorParamsDiff(on_disk=True)},
+                    collection_params=models.CollectionParamsDiff(on_disk_payload=True),
+                    quantization_config=self.quantization_config,
+                )
+
+    def upsert(self, collection_name: str, points: List[Tuple]):
+        self.client.upsert(
+            collection_name=collection_name,
+            points=[
+                models.PointStruct(id=point_id, vector=vector, payload=payload)
+                for point_id, vector, payload in points
+            ]
+        )
+
+    def delete_by_block_ids(self, collection_name: str, block_ids: Iterable):
+        """Delete every point whose payload block_id is one of block_ids"""
+        self.client.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(filter=models.Filter(should=[
+                models.FieldCondition(key="block_id", match=models.MatchValue(value=block_id))
+                for block_id in block_ids
+            ])),
+        )
+
+    def search(self, collection_name: str, query_vector: List[float], limit: int):
+        return self.client.search(
+            collection_name=collection_name, query_vector=query_vector, limit=limit, search_params=self.search_params
+        )
+
+    async def async_search(self, collection_name: str, query_vector: List[float], limit: int):
+        if self.async_client is None:
+            return await asyncio.to_thread(self.search, collection_name, query_vector, limit)
+        return await self.async_client.search(
+            collection_name=collection_name, query_vector=query_vector, limit=limit, search_params=self.search_params
+        )
@@ -0,0 +1,156 @@
+import argparse
+import logging
+import os
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+# Only the standard library (and embedding_server, which imports nothing else)
+# is imported at module level: the CLIs import this to find a running daemon
+# before deciding whether to load anything heavy
+from embedding_server import load_authkey
+
+logger = logging.getLogger(__name__)
+
+QUERY_DAEMON_SOCKET = os.getenv('QUERY_DAEMON_SOCKET', '../../query_daemon.sock')
+QUERY_DAEMON_AUTHKEY = os.getenv('QUERY_DAEMON_AUTHKEY')
+
+class QueryDaemon:
+    """
+    Long-lived process keeping a VectorStore (model and Qdrant client) warm
+    and answering searches over a Unix socket
+    The store's search target is reported to clients, so ones wanting other
+    vectors can tell this daemon doesn't search them.
+    """
+    def __init__(self, vector_store, address=QUERY_DAEMON_SOCKET, authkey=QUERY_DAEMON_AUTHKEY):
+        self.vector_store = vector_store
+        self.address = address
+        self.authkey = load_authkey(authkey)
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    op = request.get("op")
+                    if op == "search":
+                        result = self.vector_store.search(request["query"], limit=request["limit"], chunks=request["chunks"])
+                    elif op == "info":
+                        result = {"target": self.vector_store.target}
+                    else:
+                        raise ValueError(f"Unknown operation: {op}")
+                    conn.send({"ok": True, "result": result})
+                except Exception as e:
+                    logger.error(f"Query failed: {e}")
+                    conn.send({"ok": False, "error": f"{type(e).__name__}: {e}"})
+
+    def serve_forever(self):
+        # Warm up the model so the first query doesn't pay for loading it
+        self.vector_store.embed_query("")
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        with Listener(self.address, family='AF_UNIX', authkey=self.authkey) as listener:
+            os.chmod(self.address, 0o600)
+            logger.info(f"Query daemon listening on {self.address}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except Exception as e:
+                    logger.warning(f"Rejected query client: {e}")
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+class QueryClient:
+    """Client for a running QueryDaemon with the same search() as VectorStore"""
+    def __init__(self, conn):
+        self._conn = conn
+
+    @classmethod
+    def connect(cls, address=QUERY_DAEMON_SOCKET, authkey=QUERY_DAEMON_AUTHKEY):
+        """Connect to the daemon, or return None if it isn't running or rejects the authkey"""
+        return cls._connect(address, authkey)[0]
+
+    @classmethod
+    def _connect(cls, address, authkey):
+        """
+        Returns:
+            (client or None, AuthenticationError if a running daemon rejected the authkey, else None)
+        """
+        if not os.path.exists(address):
+            return None, None
+        try:
+            return cls(Client(address, family='AF_UNIX', authkey=load_authkey(authkey))), None
+        except AuthenticationError as e:
+            logger.warning(f"Query daemon at {address} rejected the authkey: {e}")
+            return None, e
+        except OSError as e:
+            logger.debug(f"Query daemon at {address} is not reachable: {e}")
+            return None, None
+
+    def _call(self, request):
+        self._conn.send(request)
+        response = self._conn.recv()
+        if not response["ok"]:
+            raise RuntimeError(f"Query daemon error: {response['error']}")
+        return response["result"]
+
+    def search(self, query, limit=5, chunks=False):
+        return self._call({"op": "search", "query": query, "limit": limit, "chunks": chunks})
+
+    def info(self):
+        """Get the search target of the daemon's VectorStore"""
+        return self._call({"op": "info"})
+
+    def close(self):
+        self._conn.close()
+
+def get_searcher(qdrant_host=None, qdrant_port=None, address=QUERY_DAEMON_SOCKET):
+    """
+    Get an object with VectorStore.search: a client of the running query
+    daemon if it searches the vectors a VectorStore(host=qdrant_host,
+    port=qdrant_port) would (the same backend, server or storage path),
+    otherwise a VectorStore in this process
+    """
+    from vector_store import VectorStore, search_target
+
+    target = search_target(qdrant_host, qdrant_port)
+    client, auth_error = QueryClient._connect(address, QUERY_DAEMON_AUTHKEY)
+    if client is not None:
+        daemon_target = tuple(client.info()["target"])
+        if daemon_target == target:
+            logger.debug(f"Using query daemon at {address}")
+            return client
+        logger.info(f"Query daemon at {address} searches {daemon_target}, not {target}; searching in this process")
+        client.close()
+    elif auth_error is not None and target[0] == "qdrant" and target[1] is None:
+        # Local storage is locked to one client, which may well be the daemon
+        raise RuntimeError(
+            f"The query daemon at {address} rejected this process's authkey and may hold the local Qdrant "
+            f"storage at {target[3]}; set QUERY_DAEMON_AUTHKEY to the daemon's key, or stop the daemon"
+        )
+    return VectorStore(host=qdrant_host, port=qdrant_port)
+
+def main():
+    parser = argparse.ArgumentParser(description='Keep the embedding model and Qdrant client warm for CLI searches')
+    parser.add_argument('--socket', default=QUERY_DAEMON_SOCKET, help='Unix socket path to listen on')
+    parser.add_argument('--qdrant-host', help='Remote Qdrant host (if not specified, uses local storage)')
+    parser.add_argument('--qdrant-port', type=int, help='Remote Qdrant port')
+    parser.add_argument('--embedding-server', help='Unix socket of a running embedding_server.py to encode with')
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    from vector_store import VectorStore
+
+    encoder = None
+    if args.embedding_server:
+        from embedding_server import RemoteEncoder
+        encoder = RemoteEncoder(args.embedding_server)
+    vector_store = VectorStore(host=args.qdrant_host, port=args.qdrant_port, encoder=encoder)
+    QueryDaemon(vector_store, address=args.socket).serve_forever()
+
+if __name__ == "__main__":
+    main()
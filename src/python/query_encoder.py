@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+QUERY_MAX_BATCH = 32       # queries encoded in one forward pass at most
+QUERY_MAX_WAIT_MS = 5      # how long the first query in a batch waits for others to join
+
+class QueryBatcher:
+    """
+    Micro-batching front end for a query encoder
+    Concurrent encode() calls are collected for up to max_wait_ms (or until
+    max_batch_size queries are waiting) and encoded together with one call to
+    encode_batch(texts), which runs on a dedicated thread so the event loop
+    stays free while the model is busy.
+    """
+    def __init__(
+        self,
+        encode_batch: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = QUERY_MAX_BATCH,
+        max_wait_ms: float = QUERY_MAX_WAIT_MS,
+    ):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        # One thread: batches are serialized on the model, never interleaved
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-encoder")
+        self._queue = None
+        self._task = None
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = Counter()
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, text: str) -> List[float]:
+        """Encode one query, sharing a forward pass with any concurrent queries"""
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    async def _collect(self):
+        """Wait for a query, then gather more until the batch is full or max_wait passes"""
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
+            try:
+                embeddings = await loop.run_in_executor(self._executor, self.encode_batch, texts)
+            except Exception as e:
+                logger.error(f"Query encoding failed for batch of {len(batch)}: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+            for (_, future), embedding in zip(batch, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+
+    def stats(self) -> dict:
+        """Batch size metrics since startup"""
+        with self._stats_lock:
+            sizes = dict(self._batch_sizes)
+        batches = sum(sizes.values())
+        queries = sum(size * count for size, count in sizes.items())
+        return {
+            "batches": batches,
+            "queries": queries,
+            "mean_batch_size": queries / batches if batches else 0.0,
+            "max_batch_size": max(sizes) if sizes else 0,
+            "batch_size_histogram": {str(size): sizes[size] for size in sorted(sizes)},
+            "max_batch": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self._executor.shutdown(wait=False)
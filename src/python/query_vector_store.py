@@ -1,6 +1,6 @@
 import argparse
 import logging
-from vector_store import VectorStore
+from query_daemon import QUERY_DAEMON_SOCKET, get_searcher
 
 def setup_logging(debug=False):
     """Configure logging level and format"""
@@ -23,6 +23,26 @@ def main():
         default=5,
         help='Maximum number of results to return (default: 5)'
     )
+    parser.add_argument(
+        '--chunks',
+        action='store_true',
+        help='Search the passage index and return the best passage per block'
+    )
+    parser.add_argument(
+        '--keyword',
+        action='store_true',
+        help='BM25 keyword search over the SQLite full-text index instead of vector search (no model needed)'
+    )
+    parser.add_argument(
+        '--hybrid',
+        action='store_true',
+        help='Fuse vector and keyword search rankings (helps with rare names)'
+    )
+    parser.add_argument(
+        '--db',
+        default='../../store.sqlite3',
+        help='SQLite database used by --keyword and --hybrid (default: ../../store.sqlite3)'
+    )
     parser.add_argument(
         '--qdrant-host',
         help='Remote Qdrant host (if not specified, uses local storage)'
@@ -32,6 +52,11 @@ def main():
         type=int,
         help='Remote Qdrant port'
     )
+    parser.add_argument(
+        '--daemon-socket',
+        default=QUERY_DAEMON_SOCKET,
+        help='Socket of a running query_daemon.py; searches run in-process if it is not running'
+    )
     parser.add_argument(
         '--debug',
         action='store_true',
@@ -48,14 +73,35 @@ def main():
     # Setup logging
     setup_logging(args.debug)
 
-    # Initialize vector store
-    vector_store = VectorStore(
-        host=args.qdrant_host,
-        port=args.qdrant_port
-    )
+    if args.keyword or args.hybrid:
+        from arena_utils import connect_db, init_db
+
+        # Builds the keyword index on first use against an older database
+        conn = connect_db(args.db)
+        try:
+            init_db(conn)
+        finally:
+            conn.close()
+
+    if args.keyword:
+        from arena_utils import connect_db, keyword_search
+
+        conn = connect_db(args.db)
+        try:
+            results = keyword_search(conn, args.query, limit=args.limit)
+        finally:
+            conn.close()
+    else:
+        # Use the warm query daemon if it is running, otherwise load the model here
+        vector_store = get_searcher(args.qdrant_host, args.qdrant_port, address=args.daemon_socket)
+
+        # Search for similar content
+        if args.hybrid:
+            from hybrid_search import hybrid_search
 
-    # Search for similar content
-    results = vector_store.search(args.query, limit=args.limit)
+            results = hybrid_search(vector_store, args.db, args.query, limit=args.limit, chunks=args.chunks)
+        else:
+            results = vector_store.search(args.query, limit=args.limit, chunks=args.chunks)
 
     # Output results based on format
     if args.format == 'json':
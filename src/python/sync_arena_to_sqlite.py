@@ -1,4 +1,5 @@
-import sqlite3
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from arena_utils import *
 
 # Example channel configuration
@@ -9,17 +10,40 @@ ARENA_CHANNELS = [
 ]
 
 def main():
+    parser = argparse.ArgumentParser(description='Sync Are.na channel blocks to SQLite')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only fetch and save blocks changed since the last sync of each channel')
+    args = parser.parse_args()
+
     # Initialize DB
-    conn = sqlite3.connect('store.sqlite3')
+    conn = connect_db('store.sqlite3')
     init_db(conn)
 
-    # Get all blocks from channels
-    channel_blocks = {}
-    for channel in ARENA_CHANNELS:
-        # Get channel info
-        channel_blocks[channel["name"]] = get_channel(channel["slug"])
-        # Override with full set of contents (paginated)
-        channel_blocks[channel["name"]]["contents"] = get_channel_blocks_paginated(channel["slug"])
+    # Get all blocks from channels, fetching channels and their pages concurrently
+    channel_blocks = {channel["name"]: {"contents": []} for channel in ARENA_CHANNELS}
+    channel_names_by_slug = {channel["slug"]: channel["name"] for channel in ARENA_CHANNELS}
+    # Channels whose blocks could not all be fetched keep their cursor
+    failed_slugs = set()
+    if args.incremental:
+        cursors = {slug: get_sync_cursor(conn, slug) for slug in channel_names_by_slug}
+        with ThreadPoolExecutor(max_workers=len(cursors)) as executor:
+            futures = {slug: executor.submit(get_channel_blocks_since, slug, since=cursors[slug]) for slug in cursors}
+            for slug, future in futures.items():
+                try:
+                    blocks = future.result()
+                except Exception as e:
+                    print(f"Error fetching changes of {slug}, leaving its cursor alone:", e)
+                    failed_slugs.add(slug)
+                    continue
+                channel_blocks[channel_names_by_slug[slug]]["contents"] = blocks
+                print(f"{channel_names_by_slug[slug]}: {len(blocks)} blocks changed since {cursors[slug]}")
+    else:
+        try:
+            for slug, block in iter_channels_blocks(list(channel_names_by_slug)):
+                channel_blocks[channel_names_by_slug[slug]]["contents"].append(block)
+        except ChannelPagesError as e:
+            print(f"{e}, leaving the cursors of those channels alone")
+            failed_slugs.update(e.failed_pages)
 
     # Convert to flat list and filter to Wikipedia blocks
     all_channel_blocks = [block for channel in channel_blocks.values() for block in channel["contents"]]
@@ -31,12 +55,17 @@ def main():
     # Save to DB (note: parsed_block_content_by_url would need to be populated)
     parsed_block_content_by_url = {}  # Map of URL -> parsed content
     save_block_to_db(conn, 
-        block_ids=list(all_blocks_by_id.keys()),
+        block_ids=get_changed_block_ids(conn, all_blocks_by_id),
         block_data_by_id=all_blocks_by_id,
         parsed_block_content_by_url=parsed_block_content_by_url
     )
 
+    # Record how far each channel has been synced
+    for channel in ARENA_CHANNELS:
+        if channel["slug"] not in failed_slugs:
+            save_sync_cursor(conn, channel["slug"], channel_blocks[channel["name"]]["contents"])
+
     conn.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,14 +1,63 @@
-from sentence_transformers import SentenceTransformer
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
-from qdrant_client.http.models import Distance, VectorParams
+import asyncio
 import logging
 import os
 import json
-from typing import Dict, List, Optional
+import threading
+from itertools import islice
+from typing import Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from uuid import NAMESPACE_URL, uuid5
+
+from chunk_utils import chunk_markdown
+from embedding_cache import EmbeddingCache, EMBEDDING_CACHE_PATH, text_hash
+from query_cache import LRUCache, QUERY_EMBEDDING_CACHE_SIZE, SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
 
 logger = logging.getLogger(__name__)
 
+# Number of texts per model.encode forward pass
+EMBED_BATCH_SIZE = 32
+# Number of points sent per Qdrant upsert request
+UPSERT_BATCH_SIZE = 256
+# Chunk hits fetched per requested block when collapsing passage hits to blocks
+CHUNK_OVERSAMPLE = 4
+# "qdrant" (server or local path storage) or "numpy" (embedded memory-mapped index)
+VECTOR_BACKEND = os.getenv('VECTOR_BACKEND', 'qdrant')
+VECTOR_INDEX_PATH = os.getenv('VECTOR_INDEX_PATH', '../../vector_index')
+# "int8" or "binary" stores quantized vectors and rescores candidates at full precision
+VECTOR_QUANTIZATION = os.getenv('VECTOR_QUANTIZATION') or None
+RESCORE_OVERSAMPLING = float(os.getenv('RESCORE_OVERSAMPLING', '3.0'))
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most `size` items from an iterable"""
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+def _point_id(block_id) -> Union[int, str]:
+    """Qdrant point id for a block: Are.na ids are used as-is, other ids map to a stable UUID"""
+    if isinstance(block_id, int) or (isinstance(block_id, str) and block_id.isdigit()):
+        return int(block_id)
+    return str(uuid5(NAMESPACE_URL, str(block_id)))
+
+def search_target(
+    host: Optional[str] = None,
+    port: Optional[int] = None,
+    backend: str = VECTOR_BACKEND,
+    path: str = "../../qdrant_data",
+    index_path: str = VECTOR_INDEX_PATH,
+) -> Tuple:
+    """
+    Identify the vectors a VectorStore with these arguments searches, as a
+    (backend, host, port, absolute storage path) tuple comparable across processes
+    """
+    if backend == "numpy":
+        return (backend, None, None, os.path.abspath(index_path))
+    if host:
+        return (backend, host, port, None)
+    return (backend, None, None, os.path.abspath(path))
+
 class VectorStore:
     def __init__(
         self,
@@ -18,109 +67,281 @@ class VectorStore:
         host: Optional[str] = None,
         port: Optional[int] = None,
         path: str = "../../qdrant_data",
+        embed_batch_size: int = EMBED_BATCH_SIZE,
+        upsert_batch_size: int = UPSERT_BATCH_SIZE,
+        embedding_cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+        query_cache_size: int = QUERY_EMBEDDING_CACHE_SIZE,
+        search_cache_size: int = SEARCH_CACHE_SIZE,
+        search_cache_ttl: Optional[float] = SEARCH_CACHE_TTL,
+        encoder=None,
+        backend: str = VECTOR_BACKEND,
+        index_path: str = VECTOR_INDEX_PATH,
+        quantization: Optional[str] = VECTOR_QUANTIZATION,
+        rescore_oversampling: float = RESCORE_OVERSAMPLING,
     ):
         """
-        Initialize vector store with either local or remote Qdrant
+        Initialize vector store with either local or remote Qdrant, or an embedded NumPy index
         Args:
-            collection_name: Name of the collection in Qdrant
+            collection_name: Name of the collection in Qdrant (passages are
+                stored in "<collection_name>_chunks")
             model_name: Name of the sentence-transformer model to use
             vector_size: Size of embedding vectors
             host: Qdrant server host (if None, uses local storage)
             port: Qdrant server port
             path: Path for local storage (only used if host is None)
+            embed_batch_size: Number of texts encoded per model forward pass
+            upsert_batch_size: Number of points sent per Qdrant upsert request
+            embedding_cache_path: SQLite file caching document embeddings by
+                text hash (None disables the cache)
+            query_cache_size: Query embeddings kept in memory
+            search_cache_size: Search results kept in memory; they are dropped
+                whenever this store writes to Qdrant
+            search_cache_ttl: Seconds cached search results are served for
+                (None keeps them until the next write)
+            encoder: Object with a SentenceTransformer-style encode(texts,
+                batch_size), e.g. an embedding_server.RemoteEncoder (which is
+                checked to serve model_name); if None the model is loaded in
+                this process on first use
+            backend: "qdrant" or "numpy" (exact search over memory-mapped
+                vectors in index_path; host, port and path are ignored)
+            index_path: Directory of the NumPy index
+            quantization: None, "int8" or "binary": search quantized vectors,
+                then rescore limit * rescore_oversampling candidates with the
+                float32 vectors
+            rescore_oversampling: Candidates rescored per requested result
         """
         self.collection_name = collection_name
+        self.chunk_collection_name = f"{collection_name}_chunks"
+        self.target = search_target(host, port, backend, path, index_path)
+        self.embed_batch_size = embed_batch_size
+        self.upsert_batch_size = upsert_batch_size
         
-        # Initialize embedding model
-        logger.info(f"Loading embedding model: {model_name}")
-        self.model = SentenceTransformer(model_name)
+        # Embedding model, loaded on first encode unless a shared encoder is given
+        self.model_name = model_name
+        self._model = encoder
+        if hasattr(encoder, "expect_model"):
+            encoder.expect_model(model_name, vector_size)
+        self._model_lock = threading.Lock()
+        self.embedding_cache = EmbeddingCache(model_name, embedding_cache_path) if embedding_cache_path else None
+
+        # Repeated queries skip the model and Qdrant; every write bumps the
+        # generation, which discards cached results
+        self.query_embedding_cache = LRUCache(query_cache_size)
+        self.search_cache = LRUCache(search_cache_size, ttl=search_cache_ttl)
+        self.generation = 0
+        self._generation_lock = threading.Lock()
         
-        # Initialize Qdrant client
-        if host:
-            logger.info(f"Connecting to Qdrant at {host}:{port}")
-            api_key = os.getenv('QDRANT_API_KEY')
-            self.client = QdrantClient(host=host, port=port, api_key=api_key)
+        # Backends are imported on demand so the NumPy backend never loads qdrant_client
+        if backend == "numpy":
+            from numpy_index import NumpyBackend
+            self.backend = NumpyBackend(index_path, quantization=quantization, rescore_oversampling=rescore_oversampling)
+        elif backend == "qdrant":
+            from qdrant_backend import QdrantBackend
+            self.backend = QdrantBackend(
+                host=host, port=port, path=path, quantization=quantization, rescore_oversampling=rescore_oversampling
+            )
         else:
-            logger.info(f"Using local Qdrant storage at {path}")
-            self.client = QdrantClient(path=path)
-            
-        # Create collection if it doesn't exist
-        self._create_collection(vector_size)
-        
-    def _create_collection(self, vector_size: int):
-        """Create Qdrant collection if it doesn't exist"""
-        collections = self.client.get_collections().collections
-        exists = any(c.name == self.collection_name for c in collections)
+            raise ValueError(f"Unknown vector backend: {backend}")
+
+        # Create collections if they don't exist
+        self.backend.create_collection(self.collection_name, vector_size)
+        self.backend.create_collection(self.chunk_collection_name, vector_size)
         
-        if not exists:
-            logger.info(f"Creating collection: {self.collection_name}")
-            self.client.create_collection(
-                collection_name=self.collection_name,
-                vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
-            )
-            
-    def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for a list of texts"""
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+
+                    logger.info(f"Loading embedding model: {self.model_name}")
+                    self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    def generate_embeddings(
+        self,
+        texts: List[str],
+        batch_size: Optional[int] = None,
+        use_cache: bool = True,
+    ) -> List[List[float]]:
+        """
+        Generate embeddings for a list of texts, encoding `batch_size` texts per forward pass
+        Texts already in the embedding cache are not re-encoded.
+        """
         logger.debug(f"Generating embeddings for {len(texts)} texts")
-        return self.model.encode(texts).tolist()
-        
-    def upsert_blocks(self, blocks_data: Dict[str, dict]):
+        batch_size = batch_size or self.embed_batch_size
+        if self.embedding_cache is None or not use_cache:
+            return self.model.encode(texts, batch_size=batch_size).tolist()
+
+        embeddings = self.embedding_cache.get_many(texts)
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        logger.debug(f"Embedding cache: {len(texts) - len(missing)} hits, {len(missing)} misses")
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            encoded = self.model.encode(missing_texts, batch_size=batch_size).tolist()
+            self.embedding_cache.put_many(missing_texts, encoded)
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        return embeddings
+
+    def _bump_generation(self):
+        """Invalidate cached search results after a write"""
+        with self._generation_lock:
+            self.generation += 1
+            self.search_cache.clear()
+
+    def _cache_results(self, key: tuple, results: List[dict], generation: int):
+        """Cache results unless a write happened while they were being computed"""
+        with self._generation_lock:
+            if generation == self.generation:
+                self.search_cache.put(key, results)
+
+    def cache_stats(self) -> dict:
+        """Hit/miss counters of the in-memory query caches"""
+        return {
+            "generation": self.generation,
+            "query_embeddings": self.query_embedding_cache.stats(),
+            "search_results": self.search_cache.stats(),
+        }
+
+    def _block_point(self, block_id: str, block: dict, embedding: List[float]) -> tuple:
+        """Build the (id, vector, payload) point for a block and its embedding"""
+        payload = {
+            "block_id": block_id,
+            "title": block.get("title", ""),
+            "description": block.get("description", ""),
+            "source_url": block.get("source_url", ""),
+            "text_preview": block["crawled_text"][:200] if block.get("crawled_text") else "",
+        }
+        return (_point_id(block_id), embedding, payload)
+
+    def upsert_blocks(self, blocks_data: Union[Dict[str, dict], Iterable[Tuple[str, dict]]]):
         """
-        Upsert blocks with their embeddings to Qdrant
+        Upsert blocks with their embeddings to the vector backend
+        Blocks are consumed in windows of `upsert_batch_size`: each window is
+        sorted by text length (so encode batches pad to similar lengths),
+        embedded in batches of `embed_batch_size` and sent as one upsert
+        request, so memory stays bounded by the window size.
         Args:
-            blocks_data: Dict of block_id -> block_data
+            blocks_data: Dict of block_id -> block_data, or an iterable of
+                (block_id, block_data) pairs
         """
-        logger.info(f"Upserting {len(blocks_data)} blocks to vector store")
-        
-        points = []
-        for block_id, block in blocks_data.items():
-            if not block.get("crawled_text"):
-                logger.debug(f"Skipping block {block_id} - no crawled text")
-                continue
-                
-            # Generate embedding for the block's text
-            embedding = self.generate_embeddings([block["crawled_text"]])[0]
-            
-            # Prepare metadata
-            payload = {
-                "block_id": block_id,
-                "title": block.get("title", ""),
-                "description": block.get("description", ""),
-                "source_url": block.get("source_url", ""),
-                "text_preview": block["crawled_text"][:200] if block.get("crawled_text") else "",
-            }
-            
-            points.append(models.PointStruct(
-                id=block_id,
-                vector=embedding,
-                payload=payload
-            ))
-            
-        if points:
-            logger.debug(f"Upserting {len(points)} points to Qdrant")
-            self.client.upsert(
-                collection_name=self.collection_name,
-                points=points
-            )
+        items = blocks_data.items() if isinstance(blocks_data, dict) else blocks_data
+        if isinstance(blocks_data, dict):
+            logger.info(f"Upserting {len(blocks_data)} blocks to vector store")
+
+        def with_text():
+            for block_id, block in items:
+                if not block.get("crawled_text"):
+                    logger.debug(f"Skipping block {block_id} - no crawled text")
+                    continue
+                yield block_id, block
+
+        total = 0
+        for window in _batched(with_text(), self.upsert_batch_size):
+            window.sort(key=lambda item: len(item[1]["crawled_text"]))
+            embeddings = self.generate_embeddings([block["crawled_text"] for _, block in window])
+            points = [
+                self._block_point(block_id, block, embedding)
+                for (block_id, block), embedding in zip(window, embeddings)
+            ]
+            logger.debug(f"Upserting {len(points)} points")
+            self.backend.upsert(self.collection_name, points)
+            self._bump_generation()
+            total += len(points)
+        logger.info(f"Upserted {total} points to vector store")
         
-    def search(self, query: str, limit: int = 5) -> List[dict]:
+    def upsert_block_chunks(
+        self,
+        blocks_data: Union[Dict[str, dict], Iterable[Tuple[str, dict]]],
+        chunks_by_block_id: Optional[Dict[str, List[dict]]] = None,
+    ):
         """
-        Search for similar blocks using a text query
+        Upsert one point per passage of each block to the chunk collection
+        Previous passages of each block are deleted first, so re-chunking a
+        block never leaves stale points behind.
         Args:
-            query: Text query to search for
-            limit: Maximum number of results to return
-        Returns:
-            List of similar blocks with their scores
+            blocks_data: Dict of block_id -> block_data, or an iterable of
+                (block_id, block_data) pairs
+            chunks_by_block_id: Precomputed chunks (e.g. already saved to
+                SQLite); blocks missing from it are chunked here
         """
-        logger.debug(f"Searching for: {query}")
-        query_vector = self.generate_embeddings([query])[0]
-        
-        results = self.client.search(
-            collection_name=self.collection_name,
-            query_vector=query_vector,
-            limit=limit
-        )
+        items = blocks_data.items() if isinstance(blocks_data, dict) else blocks_data
+        chunks_by_block_id = chunks_by_block_id or {}
+
+        def windows():
+            # Keep each block's passages in one window so its delete and upsert stay together
+            window = []
+            for block_id, block in items:
+                chunks = chunks_by_block_id.get(block_id)
+                if chunks is None:
+                    chunks = chunk_markdown(block.get("crawled_text"))
+                if not chunks:
+                    logger.debug(f"Skipping block {block_id} - no chunks")
+                    continue
+                window.extend((block_id, block, chunk) for chunk in chunks)
+                if len(window) >= self.upsert_batch_size:
+                    yield window
+                    window = []
+            if window:
+                yield window
+
+        total = 0
+        for window in windows():
+            block_ids = list(dict.fromkeys(block_id for block_id, _, _ in window))
+            self.backend.delete_by_block_ids(self.chunk_collection_name, block_ids)
+
+            window.sort(key=lambda item: len(item[2]["text"]))
+            embeddings = self.generate_embeddings([chunk["text"] for _, _, chunk in window])
+            points = [
+                (
+                    str(uuid5(NAMESPACE_URL, f"{block_id}:{chunk['chunk_index']}")),
+                    embedding,
+                    {
+                        "block_id": block_id,
+                        "chunk_index": chunk["chunk_index"],
+                        "offset": chunk["offset"],
+                        "heading": chunk.get("heading"),
+                        "text": chunk["text"],
+                        "title": block.get("title", ""),
+                        "description": block.get("description", ""),
+                        "source_url": block.get("source_url", ""),
+                    },
+                )
+                for (block_id, block, chunk), embedding in zip(window, embeddings)
+            ]
+            for batch in _batched(points, self.upsert_batch_size):
+                logger.debug(f"Upserting {len(batch)} chunk points")
+                self.backend.upsert(self.chunk_collection_name, batch)
+            self._bump_generation()
+            total += len(points)
+        logger.info(f"Upserted {total} chunk points to vector store")
+
+    def _collapse_chunk_hits(self, hits, limit: int) -> List[dict]:
+        """Keep the best-scoring passage per block, in score order"""
+        results = {}
+        for hit in hits:
+            block_id = hit.payload["block_id"]
+            if block_id in results:
+                continue
+            results[block_id] = {
+                "score": hit.score,
+                "block_id": block_id,
+                "title": hit.payload["title"],
+                "description": hit.payload["description"],
+                "source_url": hit.payload["source_url"],
+                "text_preview": hit.payload["text"],
+                "chunk_index": hit.payload["chunk_index"],
+                "chunk_offset": hit.payload["offset"],
+            }
+            if len(results) == limit:
+                break
+        return list(results.values())
         
+    def _format_hits(self, hits, limit: int, chunks: bool) -> List[dict]:
+        """Turn backend hits into result dicts"""
+        if chunks:
+            return self._collapse_chunk_hits(hits, limit)
         return [
             {
                 "score": hit.score,
@@ -130,5 +351,82 @@ class VectorStore:
                 "source_url": hit.payload["source_url"],
                 "text_preview": hit.payload["text_preview"],
             }
-            for hit in results
-        ]
\ No newline at end of file
+            for hit in hits
+        ]
+
+    def _search_args(self, query_vector: List[float], limit: int, chunks: bool) -> tuple:
+        if chunks:
+            return self.chunk_collection_name, query_vector, limit * CHUNK_OVERSAMPLE
+        return self.collection_name, query_vector, limit
+
+    def search_by_vector(self, query_vector: List[float], limit: int = 5, chunks: bool = False) -> List[dict]:
+        """Search for similar blocks using an already encoded query"""
+        hits = self.backend.search(*self._search_args(query_vector, limit, chunks))
+        return self._format_hits(hits, limit, chunks)
+
+    async def async_search_by_vector(self, query_vector: List[float], limit: int = 5, chunks: bool = False) -> List[dict]:
+        """Search for similar blocks without blocking the event loop"""
+        hits = await self.backend.async_search(*self._search_args(query_vector, limit, chunks))
+        return self._format_hits(hits, limit, chunks)
+
+    def embed_query(self, query: str) -> List[float]:
+        """Encode a search query, reusing the embedding of an identical earlier query"""
+        key = (self.model_name, text_hash(query))
+        query_vector = self.query_embedding_cache.get(key)
+        if query_vector is None:
+            query_vector = self.generate_embeddings([query], use_cache=False)[0]
+            self.query_embedding_cache.put(key, query_vector)
+        return query_vector
+
+    def search(self, query: str, limit: int = 5, chunks: bool = False) -> List[dict]:
+        """
+        Search for similar blocks using a text query
+        Args:
+            query: Text query to search for
+            limit: Maximum number of results to return
+            chunks: Search the passage index and collapse hits back to blocks,
+                returning the best matching passage as text_preview
+        Returns:
+            List of similar blocks with their scores
+        """
+        logger.debug(f"Searching for: {query}")
+        key = (text_hash(query), limit, chunks)
+        results = self.search_cache.get(key)
+        if results is not None:
+            return list(results)
+        generation = self.generation
+        results = self.search_by_vector(self.embed_query(query), limit=limit, chunks=chunks)
+        self._cache_results(key, results, generation)
+        return list(results)
+
+    async def async_search(
+        self,
+        query: str,
+        limit: int = 5,
+        chunks: bool = False,
+        encode: Optional[Callable[[str], Awaitable[List[float]]]] = None,
+    ) -> List[dict]:
+        """
+        search() for use on an event loop
+        Args:
+            encode: Coroutine function encoding a query on a cache miss, e.g. a
+                QueryBatcher's encode (default: encode in a worker thread)
+        """
+        key = (text_hash(query), limit, chunks)
+        results = self.search_cache.get(key)
+        if results is not None:
+            return list(results)
+        generation = self.generation
+
+        embedding_key = (self.model_name, text_hash(query))
+        query_vector = self.query_embedding_cache.get(embedding_key)
+        if query_vector is None:
+            if encode is None:
+                query_vector = (await asyncio.to_thread(self.generate_embeddings, [query], use_cache=False))[0]
+            else:
+                query_vector = await encode(query)
+            self.query_embedding_cache.put(embedding_key, query_vector)
+
+        results = await self.async_search_by_vector(query_vector, limit=limit, chunks=chunks)
+        self._cache_results(key, results, generation)
+        return list(results)